@@ -0,0 +1,262 @@
+import os
+import time
+import heapq
+import logging
+from array import array
+from typing import Any, Dict, List, Optional, Tuple
+
+from marzban_api import MarzbanAPI
+
+logger = logging.getLogger(__name__)
+
+STATUS_CODES = {'active': 0, 'disabled': 1, 'limited': 2, 'expired': 3, 'on_hold': 4}
+STATUS_NAMES = {code: name for name, code in STATUS_CODES.items()}
+
+# (bucket seconds, buckets kept): 1 minute for a day, 1 hour for 30 days, 1 day for a year
+DEFAULT_LEVELS = ((60, 1440), (3600, 720), (86400, 366))
+
+class TimeSeries:
+    """Fixed-size multi-resolution time series backed by flat arrays.
+
+    Every sample lands in one ring-buffer bucket per resolution level, so
+    coarser levels are downsampled as data arrives and memory never grows.
+    Buckets aggregate with 'sum' (counters), 'max' or 'mean' (gauges).
+    """
+
+    def __init__(self, mode: str = 'mean', levels=DEFAULT_LEVELS):
+        self.mode = mode
+        self.levels = levels
+        self._stamps = [array('q', [-1]) * size for _, size in levels]
+        self._values = [array('d', [0.0]) * size for _, size in levels]
+        self._counts = [array('I', [0]) * size for _, size in levels]
+
+    def add(self, value: float, timestamp: Optional[float] = None):
+        timestamp = time.time() if timestamp is None else timestamp
+        for level, (step, size) in enumerate(self.levels):
+            bucket = int(timestamp // step)
+            index = bucket % size
+            stamps, values, counts = self._stamps[level], self._values[level], self._counts[level]
+            if stamps[index] != bucket:
+                stamps[index] = bucket
+                values[index] = value
+                counts[index] = 1
+                continue
+            counts[index] += 1
+            if self.mode == 'sum':
+                values[index] += value
+            elif self.mode == 'max':
+                values[index] = max(values[index], value)
+            else:
+                values[index] += (value - values[index]) / counts[index]
+
+    def points(self, window: float, now: Optional[float] = None, step: Optional[int] = None) -> List[Tuple[int, float]]:
+        """(bucket start, value) pairs covering the last window seconds.
+
+        Read from the level with the given bucket step, or by default the
+        finest level that covers the window.
+        """
+        now = time.time() if now is None else now
+        for level, (level_step, size) in enumerate(self.levels):
+            if step is not None:
+                if level_step == step:
+                    break
+            elif level_step * size >= window:
+                break
+        else:
+            if step is not None:
+                raise ValueError(f"No level with a {step}s step")
+        step, size = self.levels[level]
+
+        first, last = int((now - window) // step) + 1, int(now // step)
+        stamps, values = self._stamps[level], self._values[level]
+        points = []
+        for bucket in range(max(first, last - size + 1), last + 1):
+            index = bucket % size
+            if stamps[index] == bucket:
+                points.append((bucket * step, values[index]))
+        return points
+
+    def total(self, window: float, now: Optional[float] = None) -> float:
+        return sum(value for _, value in self.points(window, now))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'mode': self.mode,
+            'stamps': [list(stamps) for stamps in self._stamps],
+            'values': [list(values) for values in self._values],
+            'counts': [list(counts) for counts in self._counts],
+        }
+
+    def load(self, data: Dict[str, Any]):
+        for level, (_, size) in enumerate(self.levels):
+            if level < len(data['stamps']) and len(data['stamps'][level]) == size:
+                self._stamps[level] = array('q', data['stamps'][level])
+                self._values[level] = array('d', data['values'][level])
+                self._counts[level] = array('I', data['counts'][level])
+
+class UsageAnalytics:
+    """Incremental usage aggregates for admin reports.
+
+    Fed by periodic get_system_stats calls, streamed user listings and
+    webhook events; reports are computed from these aggregates only and
+    never call the panel.
+    """
+
+    def __init__(self, marzban: MarzbanAPI):
+        self.marzban = marzban
+        self.refresh_interval = float(os.getenv('ANALYTICS_REFRESH_INTERVAL', '300'))
+
+        # Per-user columns; _index maps a username to its row
+        self._index: Dict[str, int] = {}
+        self._names: List[Optional[str]] = []
+        self._used = array('q')
+        self._limit = array('q')
+        self._status = array('b')
+        self._free_rows: List[int] = []
+
+        self.series = {
+            'users_active': TimeSeries('mean'),
+            'users_total': TimeSeries('mean'),
+            'traffic': TimeSeries('sum'),
+            'daily_active': TimeSeries('max'),
+        }
+        self._last_bandwidth = None
+        self._active_day = None
+        self._active_today = set()
+        self.last_refresh = None
+
+    def _row(self, username: str) -> int:
+        row = self._index.get(username)
+        if row is None:
+            if self._free_rows:
+                row = self._free_rows.pop()
+                self._names[row] = username
+            else:
+                row = len(self._names)
+                self._names.append(username)
+                self._used.append(0)
+                self._limit.append(0)
+                self._status.append(0)
+            self._index[username] = row
+        return row
+
+    def _mark_active(self, username: str, now: float):
+        day = int(now // 86400)
+        if day != self._active_day:
+            self._active_day = day
+            self._active_today = set()
+        self._active_today.add(username)
+        self.series['daily_active'].add(len(self._active_today), now)
+
+    def update_user(self, user: Dict[str, Any], now: Optional[float] = None):
+        """Record the latest counters for one user (from a listing or a get_user)"""
+        now = time.time() if now is None else now
+        username = user.get('username')
+        if not username:
+            return
+        row = self._row(username)
+        used = user.get('used_traffic') or 0
+        if used > self._used[row] and self._used[row]:
+            self._mark_active(username, now)
+        self._used[row] = used
+        self._limit[row] = user.get('data_limit') or 0
+        self._status[row] = STATUS_CODES.get(user.get('status'), -1)
+
+    def remove_user(self, username: str):
+        row = self._index.pop(username, None)
+        if row is not None:
+            self._names[row] = None
+            self._free_rows.append(row)
+
+    def record_event(self, action: str, username: Optional[str], now: Optional[float] = None):
+        """Apply a Marzban webhook event to the aggregates"""
+        now = time.time() if now is None else now
+        if not username:
+            return
+        if action == 'user_deleted':
+            self.remove_user(username)
+            return
+
+        row = self._row(username)
+        status = {'user_limited': 'limited', 'user_expired': 'expired', 'user_created': 'active'}.get(action)
+        if status:
+            self._status[row] = STATUS_CODES[status]
+
+    async def refresh(self):
+        """Pull system stats and stream every user to update the aggregates"""
+        started = time.perf_counter()
+        now = time.time()
+
+        stats = await self.marzban.get_system_stats()
+        if stats:
+            self.series['users_active'].add(stats.get('users_active', 0), now)
+            self.series['users_total'].add(stats.get('total_user', 0), now)
+            bandwidth = (stats.get('incoming_bandwidth') or 0) + (stats.get('outgoing_bandwidth') or 0)
+            if self._last_bandwidth is not None and bandwidth >= self._last_bandwidth:
+                self.series['traffic'].add(bandwidth - self._last_bandwidth, now)
+            self._last_bandwidth = bandwidth
+
+        seen = set()
+        async for user in self.marzban.iter_users():
+            self.update_user(user, now)
+            seen.add(user.get('username'))
+        for username in set(self._index) - seen:
+            self.remove_user(username)
+
+        self.last_refresh = now
+        logger.info(f"📈 Analytics refreshed: {len(seen)} users in {time.perf_counter() - started:.2f}s")
+
+    def top_consumers(self, count: int = 10) -> List[Tuple[str, int, int]]:
+        """(username, used bytes, limit bytes) of the heaviest users"""
+        rows = heapq.nlargest(count, self._index.values(), key=self._used.__getitem__)
+        return [(self._names[row], self._used[row], self._limit[row]) for row in rows]
+
+    def near_limit(self, threshold: float = 0.8, count: int = 20) -> List[Tuple[str, float, int, int]]:
+        """(username, used fraction, used, limit) of active users past threshold of their limit"""
+        rows = [
+            row for row in self._index.values()
+            if self._limit[row] and self._status[row] == STATUS_CODES['active']
+            and self._used[row] >= threshold * self._limit[row]
+        ]
+        rows = heapq.nlargest(count, rows, key=lambda row: self._used[row] / self._limit[row])
+        return [
+            (self._names[row], self._used[row] / self._limit[row], self._used[row], self._limit[row])
+            for row in rows
+        ]
+
+    def status_counts(self) -> Dict[str, int]:
+        counts: Dict[str, int] = {}
+        for row in self._index.values():
+            name = STATUS_NAMES.get(self._status[row], 'unknown')
+            counts[name] = counts.get(name, 0) + 1
+        return counts
+
+    def daily_active(self, days: int = 7) -> List[Tuple[int, float]]:
+        """(day start, active users) per UTC day, read from the daily level"""
+        return self.series['daily_active'].points(days * 86400, step=86400)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """JSON-serializable state for the state store"""
+        return {
+            'series': {name: series.to_dict() for name, series in self.series.items()},
+            'users': {
+                name: [self._used[row], self._limit[row], self._status[row]]
+                for name, row in self._index.items()
+            },
+            'last_bandwidth': self._last_bandwidth,
+            'active_day': self._active_day,
+            'active_today': sorted(self._active_today),
+            'last_refresh': self.last_refresh,
+        }
+
+    def load(self, data: Dict[str, Any]):
+        for name, series_data in data.get('series', {}).items():
+            if name in self.series:
+                self.series[name].load(series_data)
+        for name, (used, limit, status) in data.get('users', {}).items():
+            row = self._row(name)
+            self._used[row], self._limit[row], self._status[row] = used, limit, status
+        self._last_bandwidth = data.get('last_bandwidth')
+        self._active_day = data.get('active_day')
+        self._active_today = set(data.get('active_today', []))
+        self.last_refresh = data.get('last_refresh')
@@ -1,95 +1,150 @@
 import os
+import time
+import hashlib
 import logging
 import asyncio
-from telegram import Update
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
+from telegram import Update, InputMediaPhoto, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.ext import (
+    Application, ApplicationHandlerStop, CallbackQueryHandler, CommandHandler, MessageHandler, TypeHandler,
+    filters, ContextTypes
+)
 
 from marzban_api import MarzbanAPI
 from gemini_handler import GeminiHandler
+from state_store import StateStore
+from cache import TTLCache
+from shared_state import create_shared_state
+from rate_limiter import RateLimiter
+from bulk_operations import BulkOperationEngine
+from provisioning import AccountProvisioner, ProvisioningInProgress
+from qr_codes import QRCodeService
+from templates import TEMPLATES, is_valid_markdown, safe_markdown, split_message
+from analytics import UsageAnalytics
 
 logger = logging.getLogger(__name__)
 
+# Actions offered as buttons; they run without asking the AI
+MENU_ACTIONS = [
+    ('CHECK_ACCOUNT', "📊 وضعیت اکانت"),
+    ('GET_CONFIG', "📱 دریافت کانفیگ"),
+    ('RENEW_ACCOUNT', "💳 تمدید اشتراک"),
+    ('REQUEST_ACCOUNT', "🆕 اکانت جدید"),
+]
+USERNAME_ACTIONS = ('CHECK_ACCOUNT', 'GET_CONFIG', 'RENEW_ACCOUNT')
+
 class MarzbanAIBot:
     def __init__(self):
         self.token = os.getenv('TELEGRAM_BOT_TOKEN')
-        self.allowed_users = self._parse_allowed_users()
+        self.allowed_users = self._parse_user_ids('ALLOWED_USERS')
+        self.admin_users = self._parse_user_ids('ADMIN_USERS')
+        
+        # State shared between bot workers
+        self.shared_state = create_shared_state()
+        self.rate_limiter = RateLimiter(self.shared_state)
         
         # Initialize services
-        self.marzban = MarzbanAPI()
+        self.marzban = MarzbanAPI(self.shared_state)
         self.gemini = GeminiHandler()
         
+        # Persistent state and warm caches
+        self.store = StateStore()
+        self.user_cache = TTLCache(float(os.getenv('USER_CACHE_TTL', '60')), max_size=4096)
+        self.ai_cache = TTLCache(float(os.getenv('AI_CACHE_TTL', '3600')), max_size=2048)
+        self.snapshot_interval = float(os.getenv('CACHE_SNAPSHOT_INTERVAL', '60'))
+        self._snapshot_task = None
+        
+        # Startup progress, reported by the health endpoints
+        self.readiness = {'state': False, 'telegram': False, 'marzban': False, 'ai': False}
+        self._warm_up_task = None
+        
+        # Admin bulk operations
+        self.bulk = BulkOperationEngine(self.marzban, self.store, self.shared_state)
+        
+        # Usage reports for admins
+        self.analytics = UsageAnalytics(self.marzban)
+        self._analytics_task = None
+        
+        # Self-service account creation
+        self.auto_provision = os.getenv('AUTO_PROVISION', 'false').lower() == 'true'
+        self.provisioner = AccountProvisioner(self.marzban, self.store, self.shared_state)
+        
+        # QR codes sent along with config links
+        self.qr_codes = QRCodeService(self.store)
+        self.qr_max_links = int(os.getenv('QR_MAX_LINKS', '9'))
+        
+        # Receive updates by webhook instead of polling (required for several workers)
+        self.telegram_webhook_url = os.getenv('TELEGRAM_WEBHOOK_URL', '')
+        self.telegram_webhook_port = int(os.getenv('TELEGRAM_WEBHOOK_PORT', '8443'))
+        self.telegram_webhook_secret = os.getenv('TELEGRAM_WEBHOOK_SECRET') or None
+        
         # Initialize Telegram bot
         self.app = Application.builder().token(self.token).build()
         self._setup_handlers()
         
         logger.info("✅ Bot initialized successfully")
     
-    def _parse_allowed_users(self):
-        """Parse allowed users from environment variable"""
-        users_str = os.getenv('ALLOWED_USERS', '')
+    def _parse_user_ids(self, env_var):
+        """Parse a comma separated list of Telegram user IDs from environment variable"""
+        users_str = os.getenv(env_var, '')
         if not users_str:
-            return []
-        return [int(user_id.strip()) for user_id in users_str.split(',') if user_id.strip()]
+            return set()
+        return {int(user_id.strip()) for user_id in users_str.split(',') if user_id.strip()}
+    
+    def reload_config(self):
+        """Re-read access lists and rate limits; caches and connections are kept"""
+        self.allowed_users = self._parse_user_ids('ALLOWED_USERS')
+        self.admin_users = self._parse_user_ids('ADMIN_USERS')
+        self.rate_limiter.configure()
+        logger.info(
+            f"🔄 Configuration reloaded: {len(self.allowed_users)} allowed users, {len(self.admin_users)} admins"
+        )
     
     def _setup_handlers(self):
         """Setup bot command and message handlers"""
+        # Drop updates another worker already handled
+        self.app.add_handler(TypeHandler(Update, self._dedupe_update), group=-1)
+        
         # Commands
         self.app.add_handler(CommandHandler("start", self.start_command))
         self.app.add_handler(CommandHandler("help", self.help_command))
         self.app.add_handler(CommandHandler("status", self.status_command))
         
+        # Admin commands
+        self.app.add_handler(CommandHandler("bulk_extend", self.bulk_extend_command))
+        self.app.add_handler(CommandHandler("bulk_reset", self.bulk_reset_command))
+        self.app.add_handler(CommandHandler("bulk_status", self.bulk_status_command))
+        self.app.add_handler(CommandHandler("report_top", self.report_top_command))
+        self.app.add_handler(CommandHandler("report_limits", self.report_limits_command))
+        self.app.add_handler(CommandHandler("report_active", self.report_active_command))
+        self.app.add_handler(CommandHandler("report_traffic", self.report_traffic_command))
+        
         # Messages
         self.app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_message))
         
+        # Buttons
+        self.app.add_handler(CallbackQueryHandler(self.handle_callback, pattern=r'^act:'))
+        
         # Error handler
         self.app.add_error_handler(self.error_handler)
     
+    async def _dedupe_update(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Stop processing of Telegram updates that were already claimed by a worker"""
+        if not self.shared_state.is_shared:
+            return
+        if not await self.shared_state.add_if_absent(f"telegram:update:{update.update_id}", ttl=3600):
+            logger.info(f"♻️ Skipping duplicate update {update.update_id}")
+            raise ApplicationHandlerStop
+    
     async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /start command"""
         user_id = update.effective_user.id
         
-        welcome_message = """
-🤖 **سلام! به بات پشتیبانی VPN خوش آمدید**
-
-من می‌تونم کمکتون کنم با:
-• درخواست اکانت جدید
-• بررسی وضعیت اکانت
-• تمدید اشتراک
-• دریافت فایل کانفیگ
-• راهنمایی نصب و استفاده
-
-فقط کافیه سوالتون رو بپرسید! 😊
-
-**مثال‌ها:**
-- "اکانت جدید می‌خوام"
-- "وضعیت اکانت user123 چطوره؟"
-- "چطور تو گوشیم نصب کنم؟"
-        """
-        
-        await update.message.reply_text(welcome_message, parse_mode='Markdown')
+        await self._reply(update.message, TEMPLATES.render('welcome'), reply_markup=self._main_menu_keyboard())
         logger.info(f"👋 User {user_id} started the bot")
     
     async def help_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /help command"""
-        help_text = """
-🆘 **راهنمای استفاده**
-
-**دستورات موجود:**
-• `/start` - شروع کار با بات
-• `/help` - نمایش این راهنما
-• `/status` - وضعیت سیستم
-
-**خدمات:**
-🔹 **درخواست اکانت:** "اکانت جدید می‌خوام"
-🔹 **بررسی وضعیت:** "وضعیت اکانت [نام کاربری]"
-🔹 **تمدید اشتراک:** "تمدید اکانت [نام کاربری]"
-🔹 **دریافت کانفیگ:** "فایل کانفیگ [نام کاربری]"
-🔹 **راهنمایی نصب:** "چطور نصب کنم؟"
-
-فقط کافیه سوالتون رو به زبان ساده بپرسید! 🤖
-        """
-        
-        await update.message.reply_text(help_text, parse_mode='Markdown')
+        await self._reply(update.message, TEMPLATES.render('help'))
     
     async def status_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /status command"""
@@ -98,24 +153,132 @@ class MarzbanAIBot:
             marzban_status = await self.marzban.check_connection()
             
             # Check Gemini AI
-            gemini_status = self.gemini.check_status()
+            gemini_status = await self.gemini.check_status()
             
-            status_text = f"""
-📊 **وضعیت سیستم**
-
-🔗 **اتصال مرزبان:** {'✅ متصل' if marzban_status else '❌ قطع'}
-🧠 **هوش مصنوعی:** {'✅ فعال' if gemini_status else '❌ غیرفعال'}
-🤖 **بات:** ✅ فعال
-
-آخرین بروزرسانی: {self._get_current_time()}
-            """
+            status_text = TEMPLATES.render(
+                'status',
+                marzban='✅ متصل' if marzban_status else '❌ قطع',
+                ai='✅ فعال' if gemini_status else '❌ غیرفعال',
+                updated_at=self._get_current_time()
+            )
             
-            await update.message.reply_text(status_text, parse_mode='Markdown')
+            await self._reply(update.message, status_text)
             
         except Exception as e:
             logger.error(f"Error in status command: {e}")
             await update.message.reply_text("❌ خطا در دریافت وضعیت سیستم")
     
+    async def _require_admin(self, update: Update) -> bool:
+        """Reply with an error and return False if the sender is not an admin"""
+        if update.effective_user.id in self.admin_users:
+            return True
+        await update.message.reply_text("❌ این دستور فقط برای مدیران در دسترس است.")
+        return False
+    
+    async def bulk_extend_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle /bulk_extend <days> [status] - extend every matching user"""
+        if not await self._require_admin(update):
+            return
+        
+        args = context.args or []
+        if not args or not args[0].isdigit() or int(args[0]) <= 0:
+            await update.message.reply_text("❓ استفاده: /bulk_extend <تعداد روز> [active|limited|expired|disabled]")
+            return
+        
+        params = {'days': int(args[0]), 'status': args[1] if len(args) > 1 else 'active'}
+        await self._start_bulk_job(update, context, 'extend', params)
+    
+    async def bulk_reset_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle /bulk_reset <username> ... - reset traffic for the listed users"""
+        if not await self._require_admin(update):
+            return
+        
+        usernames = list(dict.fromkeys(context.args or []))
+        if not usernames:
+            await update.message.reply_text("❓ استفاده: /bulk_reset <نام کاربری ۱> <نام کاربری ۲> ...")
+            return
+        
+        await self._start_bulk_job(update, context, 'reset', {'usernames': usernames})
+    
+    async def bulk_status_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle /bulk_status - show running bulk jobs"""
+        if not await self._require_admin(update):
+            return
+        
+        jobs = await self.bulk.running_jobs()
+        if not jobs:
+            await update.message.reply_text("ℹ️ هیچ عملیات گروهی در حال اجرا نیست.")
+            return
+        await update.message.reply_text("\n\n".join([await self.bulk.describe(job) for job in jobs]))
+    
+    async def _start_bulk_job(self, update: Update, context: ContextTypes.DEFAULT_TYPE, operation, params):
+        """Post a progress message and start a bulk job that keeps it updated"""
+        progress_message = await update.message.reply_text("📦 عملیات گروهی در حال شروع...")
+        job_id = await self.bulk.start_job(
+            context.bot, update.effective_chat.id, progress_message.message_id, operation, params
+        )
+        logger.info(f"👮 Admin {update.effective_user.id} started bulk job {job_id}")
+    
+    def _analytics_footer(self):
+        """When the report data was last refreshed from the panel"""
+        if not self.analytics.last_refresh:
+            return "\n\n⏳ داده‌ها هنوز از پنل دریافت نشده‌اند."
+        minutes = int((time.time() - self.analytics.last_refresh) // 60)
+        return f"\n\n🕐 بروزرسانی: {minutes} دقیقه پیش"
+    
+    async def report_top_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle /report_top [count] - heaviest traffic consumers"""
+        if not await self._require_admin(update):
+            return
+        
+        args = context.args or []
+        count = min(int(args[0]), 50) if args and args[0].isdigit() else 10
+        lines = [f"📊 پرمصرف‌ترین کاربران ({count} نفر):", ""]
+        for rank, (username, used, limit) in enumerate(self.analytics.top_consumers(count), 1):
+            limit_text = f"{limit / 1024**3:.1f} GB" if limit else "نامحدود"
+            lines.append(f"{rank}. {username}: {used / 1024**3:.2f} GB از {limit_text}")
+        await update.message.reply_text("\n".join(lines) + self._analytics_footer())
+    
+    async def report_limits_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle /report_limits [percent] - active users close to their data limit"""
+        if not await self._require_admin(update):
+            return
+        
+        args = context.args or []
+        percent = min(int(args[0]), 100) if args and args[0].isdigit() else 80
+        users = self.analytics.near_limit(percent / 100)
+        lines = [f"⚠️ کاربران فعال با مصرف بیش از {percent}٪ حجم:", ""]
+        for username, fraction, used, limit in users:
+            lines.append(f"• {username}: {fraction * 100:.0f}٪ ({used / 1024**3:.2f} از {limit / 1024**3:.1f} GB)")
+        if not users:
+            lines.append("هیچ کاربری یافت نشد ✅")
+        await update.message.reply_text("\n".join(lines) + self._analytics_footer())
+    
+    async def report_active_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle /report_active - daily active users and status breakdown"""
+        if not await self._require_admin(update):
+            return
+        
+        from datetime import datetime, timezone
+        lines = ["👥 کاربران فعال روزانه (۷ روز اخیر):", ""]
+        for day_start, active in self.analytics.daily_active(7):
+            lines.append(f"• {datetime.fromtimestamp(day_start, timezone.utc).strftime('%Y/%m/%d')}: {int(active)}")
+        lines += ["", "📋 وضعیت کاربران:"]
+        for status, count in sorted(self.analytics.status_counts().items()):
+            lines.append(f"• {status}: {count}")
+        await update.message.reply_text("\n".join(lines) + self._analytics_footer())
+    
+    async def report_traffic_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle /report_traffic - total panel traffic over recent periods"""
+        if not await self._require_admin(update):
+            return
+        
+        traffic = self.analytics.series['traffic']
+        lines = ["📈 ترافیک کل پنل:", ""]
+        for label, window in (("۱ ساعت", 3600), ("۲۴ ساعت", 86400), ("۷ روز", 7 * 86400), ("۳۰ روز", 30 * 86400)):
+            lines.append(f"• {label} اخیر: {traffic.total(window) / 1024**3:.2f} GB")
+        await update.message.reply_text("\n".join(lines) + self._analytics_footer())
+    
     async def handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle user messages with AI processing"""
         user_id = update.effective_user.id
@@ -126,38 +289,222 @@ class MarzbanAIBot:
             await update.message.reply_text("❌ شما مجاز به استفاده از این بات نیستید.")
             return
         
+        if not await self.rate_limiter.allow(user_id):
+            await update.message.reply_text("⏳ تعداد پیام‌های شما زیاد است. لطفاً کمی صبر کنید و دوباره تلاش کنید.")
+            return
+        
         try:
             logger.info(f"📨 Message from {user_id}: {message_text}")
             
             # Send typing indicator
             await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
             
-            # Process with Gemini AI
-            ai_response = await self.gemini.process_message(message_text)
+            # Process with Gemini AI (identical questions are answered from cache)
+            ai_response = await self._process_with_ai(message_text)
+            # AI text may contain stray Markdown characters
+            response_text = safe_markdown(ai_response['response'])
             
             # Execute action if needed
+            configs = []
             if ai_response.get('action') != 'NONE':
-                result = await self._execute_action(ai_response, user_id)
+                result = await self._execute_action(ai_response, user_id, configs)
                 if result:
-                    ai_response['response'] += f"\n\n{result}"
+                    response_text += f"\n\n{result}"
             
-            # Send response
-            await update.message.reply_text(
-                ai_response['response'], 
-                parse_mode='Markdown'
+            # Send response, offering buttons for follow-ups once an action ran
+            await self._reply(
+                update.message,
+                response_text,
+                reply_markup=self._main_menu_keyboard() if ai_response.get('action') != 'NONE' else None
             )
             
+            # Follow up with scannable QR codes for any delivered config
+            for config_info in configs:
+                await self._send_config_qr_codes(context.bot, update.effective_chat.id, config_info)
+            
         except Exception as e:
             logger.error(f"Error handling message: {e}")
             await update.message.reply_text(
                 "❌ متأسفانه خطایی رخ داد. لطفاً دوباره تلاش کنید یا با پشتیبانی تماس بگیرید."
             )
     
-    async def _execute_action(self, ai_response, user_id):
-        """Execute the action determined by AI"""
+    async def _reply(self, message, text, reply_markup=None):
+        """Reply with Markdown, split to Telegram's size limit
+        
+        Chunks that would not parse are sent as plain text straight away
+        rather than after a rejected request. Buttons go on the last chunk.
+        """
+        chunks = split_message(text)
+        for index, chunk in enumerate(chunks):
+            await message.reply_text(
+                chunk,
+                parse_mode='Markdown' if is_valid_markdown(chunk) else None,
+                reply_markup=reply_markup if index == len(chunks) - 1 else None
+            )
+    
+    def _main_menu_keyboard(self):
+        """Buttons for the common actions"""
+        buttons = [InlineKeyboardButton(label, callback_data=f"act:{action}") for action, label in MENU_ACTIONS]
+        return InlineKeyboardMarkup([buttons[i:i + 2] for i in range(0, len(buttons), 2)])
+    
+    def _username_ref(self, username):
+        """Short reference to a linked username; callback_data is limited to 64 bytes"""
+        return '#' + hashlib.sha256(username.encode()).hexdigest()[:10]
+    
+    def _username_keyboard(self, action, usernames):
+        """One button per linked username for an action that needs one"""
+        return InlineKeyboardMarkup([
+            [InlineKeyboardButton(f"👤 {username}", callback_data=f"act:{action}:{self._username_ref(username)}")]
+            for username in usernames
+        ])
+    
+    async def handle_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle menu buttons by dispatching straight to the action, without the AI"""
+        query = update.callback_query
+        user_id = update.effective_user.id
+        
+        if self.allowed_users and user_id not in self.allowed_users:
+            await query.answer("❌ شما مجاز به استفاده از این بات نیستید.", show_alert=True)
+            return
+        
+        if not await self.rate_limiter.allow(user_id):
+            await query.answer("⏳ تعداد درخواست‌های شما زیاد است. لطفاً کمی صبر کنید.", show_alert=True)
+            return
+        
+        # Stop the button's loading spinner right away
+        await query.answer()
+        
+        _, action, username = (query.data.split(':', 2) + [''])[:3]
+        if action not in dict(MENU_ACTIONS):
+            return
+        
+        try:
+            if username.startswith('#'):
+                # Resolved against this user's own links, server-side
+                username = next(
+                    (name for name in await self._linked_usernames(user_id) if self._username_ref(name) == username), ''
+                )
+            
+            if action in USERNAME_ACTIONS and not username:
+                usernames = await self._linked_usernames(user_id)
+                if len(usernames) > 1:
+                    await query.message.reply_text(
+                        "👤 کدام اکانت؟", reply_markup=self._username_keyboard(action, usernames[-8:])
+                    )
+                    return
+                if not usernames:
+                    await query.message.reply_text(
+                        "❓ لطفاً نام کاربری خود را بنویسید، مثلاً: \"وضعیت اکانت user123\""
+                    )
+                    return
+                username = usernames[0]
+            
+            configs = []
+            parameters = {'username': username} if username else {}
+            result = await self._execute_action({'action': action, 'parameters': parameters}, user_id, configs)
+            if result:
+                await self._reply(query.message, result, reply_markup=self._main_menu_keyboard())
+            
+            for config_info in configs:
+                await self._send_config_qr_codes(context.bot, update.effective_chat.id, config_info)
+                
+        except Exception as e:
+            logger.error(f"Error handling button {query.data}: {e}")
+            await query.message.reply_text(
+                "❌ متأسفانه خطایی رخ داد. لطفاً دوباره تلاش کنید یا با پشتیبانی تماس بگیرید."
+            )
+    
+    async def _process_with_ai(self, message_text):
+        """Process a message with Gemini, reusing cached answers for repeated questions"""
+        cache_key = ' '.join(message_text.lower().split())
+        cached = await self._cache_get(self.ai_cache, 'ai', cache_key)
+        if cached:
+            logger.info("⚡ AI response served from cache")
+            return cached
+        
+        ai_response = await self.gemini.process_message(message_text)
+        # Fallback answers (confidence <= 0.6) are not worth remembering
+        if ai_response.get('confidence', 0) > 0.6:
+            await self._cache_set(self.ai_cache, 'ai', cache_key, ai_response)
+        return ai_response
+    
+    async def _cache_get(self, cache, namespace, key):
+        """Read from the local cache, then from the cache shared with other workers"""
+        value = cache.get(key)
+        if value is None and self.shared_state.is_shared:
+            value = await self.shared_state.get_json(f"cache:{namespace}:{key}")
+            if value is not None:
+                cache.set(key, value)
+        return value
+    
+    async def _cache_set(self, cache, namespace, key, value):
+        """Write to the local cache and to the cache shared with other workers"""
+        cache.set(key, value)
+        # Redis rejects EX 0, and a disabled cache should not be shared anyway
+        if self.shared_state.is_shared and cache.ttl >= 1:
+            await self.shared_state.set_json(f"cache:{namespace}:{key}", value, ttl=int(cache.ttl))
+    
+    async def _load_user_state(self, namespace, user_id, default=None):
+        """Per-user state: in shared state with several workers, else in the local store"""
+        if self.shared_state.is_shared:
+            value = await self.shared_state.get_json(f"{namespace}:{user_id}")
+            return default if value is None else value
+        return self.store.get(namespace, str(user_id), default)
+    
+    async def _save_user_state(self, namespace, user_id, value):
+        if self.shared_state.is_shared:
+            await self.shared_state.set_json(f"{namespace}:{user_id}", value)
+        else:
+            self.store.set(namespace, str(user_id), value)
+    
+    async def _linked_usernames(self, user_id):
+        """Panel usernames this Telegram user has used, oldest first"""
+        return await self._load_user_state('user_links', user_id, [])
+    
+    async def _remember_username(self, user_id, username, action):
+        """Link a Telegram user to a panel username and record the conversation state"""
+        usernames = await self._linked_usernames(user_id)
+        if username not in usernames:
+            await self._save_user_state('user_links', user_id, usernames + [username])
+        await self._save_user_state('conversations', user_id, {
+            'last_action': action,
+            'username': username,
+            'updated_at': int(time.time())
+        })
+    
+    async def _last_username(self, user_id):
+        """Get the username this Telegram user talked about most recently"""
+        conversation = await self._load_user_state('conversations', user_id)
+        if conversation:
+            return conversation.get('username')
+        usernames = await self._linked_usernames(user_id)
+        return usernames[-1] if usernames else None
+    
+    async def _get_user_cached(self, username):
+        """Get user info from the panel, served from cache when fresh"""
+        user_info = await self._cache_get(self.user_cache, 'user', username)
+        if user_info is None:
+            user_info = await self.marzban.get_user(username)
+            if user_info:
+                await self._cache_set(self.user_cache, 'user', username, user_info)
+                self.analytics.update_user(user_info)
+        return user_info
+    
+    async def _execute_action(self, ai_response, user_id, configs=None):
+        """Execute the action determined by AI
+        
+        Delivered subscription info is appended to configs so the caller can
+        send QR codes after the text reply.
+        """
         action = ai_response.get('action')
         parameters = ai_response.get('parameters', {})
         
+        # Fall back to the username remembered from earlier messages
+        if action in USERNAME_ACTIONS:
+            username = parameters.get('username') or await self._last_username(user_id)
+            if username:
+                parameters = dict(parameters, username=username)
+        
         try:
             if action == 'REQUEST_ACCOUNT':
                 return await self._handle_account_request(parameters, user_id)
@@ -165,21 +512,21 @@ class MarzbanAIBot:
             elif action == 'CHECK_ACCOUNT':
                 username = parameters.get('username')
                 if username:
-                    return await self._handle_account_check(username)
+                    return await self._handle_account_check(username, user_id)
                 else:
                     return "❓ لطفاً نام کاربری را مشخص کنید"
             
             elif action == 'GET_CONFIG':
                 username = parameters.get('username')
                 if username:
-                    return await self._handle_get_config(username)
+                    return await self._handle_get_config(username, user_id, configs)
                 else:
                     return "❓ لطفاً نام کاربری را مشخص کنید"
             
             elif action == 'RENEW_ACCOUNT':
                 username = parameters.get('username')
                 if username:
-                    return await self._handle_renew_account(username)
+                    return await self._handle_renew_account(username, user_id)
                 else:
                     return "❓ لطفاً نام کاربری را مشخص کنید"
             
@@ -191,67 +538,113 @@ class MarzbanAIBot:
     
     async def _handle_account_request(self, parameters, user_id):
         """Handle new account request"""
-        # This would typically involve creating a support ticket
-        # or forwarding to admin for manual processing
-        return """
-📝 **درخواست اکانت جدید ثبت شد**
-
-درخواست شما برای ایجاد اکانت جدید ثبت شد.
-پشتیبانی ما در اسرع وقت با شما تماس خواهد گرفت.
-
-🕐 زمان پاسخ: معمولاً کمتر از 2 ساعت
-📞 پشتیبانی: @support_username
-        """
+        if self.auto_provision:
+            return await self._provision_account(user_id)
+        
+        # Without auto provisioning, requests are handled manually by support
+        return TEMPLATES.render('account_request_manual')
     
-    async def _handle_account_check(self, username):
+    async def _provision_account(self, user_id):
+        """Create the user's account (or return the existing one) with its subscription link"""
+        try:
+            record, created = await self.provisioner.provision(user_id)
+        except ProvisioningInProgress:
+            return "⏳ اکانت شما در حال ساخت است. لطفاً چند لحظه صبر کنید."
+        
+        if not record:
+            return TEMPLATES.render('provision_failed')
+        
+        username = record['username']
+        await self._remember_username(user_id, username, 'REQUEST_ACCOUNT')
+        if created:
+            # The next status check should see the new account, not a cached miss
+            self.user_cache.invalidate(username)
+        
+        return TEMPLATES.render(
+            'provision_created' if created else 'provision_existing',
+            username=username,
+            subscription_url=record.get('subscription_url') or 'موجود نیست'
+        )
+    
+    async def _handle_account_check(self, username, user_id):
         """Handle account status check"""
-        user_info = await self.marzban.get_user(username)
+        user_info = await self._get_user_cached(username)
         if user_info:
+            await self._remember_username(user_id, username, 'CHECK_ACCOUNT')
             return self._format_user_info(user_info)
         else:
-            return f"❌ کاربر '{username}' یافت نشد"
+            return TEMPLATES.render('user_not_found', username=username)
     
-    async def _handle_get_config(self, username):
+    async def _handle_get_config(self, username, user_id, configs=None):
         """Handle config file request"""
-        config_info = await self.marzban.get_user_subscription(username)
+        user_info = await self._get_user_cached(username)
+        config_info = None
+        if user_info and 'subscription_url' in user_info:
+            config_info = {
+                'subscription_url': user_info['subscription_url'],
+                'links': user_info.get('links', [])
+            }
         if config_info:
-            return f"""
-📱 **فایل کانفیگ آماده است**
-
-🔗 **لینک اشتراک:** 
-`{config_info['subscription_url']}`
-
-📋 **راهنمای نصب:**
-1. لینک بالا را کپی کنید
-2. در اپلیکیشن VPN خود وارد کنید
-3. روی "اتصال" کلیک کنید
-
-💡 **اپلیکیشن‌های پیشنهادی:**
-• اندروید: V2rayNG
-• iOS: FairVPN
-• ویندوز: V2rayN
-            """
+            await self._remember_username(user_id, username, 'GET_CONFIG')
+            if configs is not None:
+                configs.append(config_info)
+            return TEMPLATES.render('config_ready', subscription_url=config_info['subscription_url'])
         else:
-            return f"❌ اطلاعات کانفیگ برای '{username}' یافت نشد"
+            return TEMPLATES.render('config_not_found', username=username)
     
-    async def _handle_renew_account(self, username):
+    async def _send_config_qr_codes(self, bot, chat_id, config_info):
+        """Send QR codes for the subscription URL and each config link"""
+        if not self.qr_codes.enabled:
+            return
+        
+        items = [(config_info['subscription_url'], "🔗 لینک اشتراک")]
+        for link in config_info.get('links', [])[:self.qr_max_links]:
+            items.append((link, f"📱 {link.split('://', 1)[0].upper()}"))
+        
+        try:
+            rendered = await asyncio.gather(
+                *(self.qr_codes.get_photo(content) for content, _ in items), return_exceptions=True
+            )
+            
+            # A link too long for a QR code only drops its own image
+            photos, captions = [], []
+            for (_, caption), result in zip(items, rendered):
+                if isinstance(result, Exception):
+                    logger.warning(f"⚠️ Could not render QR code for {caption}: {result}")
+                    continue
+                photos.append(result)
+                captions.append(caption)
+            if not photos:
+                return
+            
+            if len(photos) == 1:
+                key, photo = photos[0]
+                message = await bot.send_photo(chat_id=chat_id, photo=photo, caption=captions[0])
+                messages = [message]
+            else:
+                media = [
+                    InputMediaPhoto(media=photo, caption=caption)
+                    for (_, photo), caption in zip(photos, captions)
+                ]
+                messages = await bot.send_media_group(chat_id=chat_id, media=media)
+            
+            # Remember what Telegram stored so repeats skip rendering and upload
+            for (key, photo), message in zip(photos, messages):
+                if isinstance(photo, bytes) and message.photo:
+                    self.qr_codes.remember_file_id(key, message.photo[-1].file_id)
+                    
+        except Exception as e:
+            logger.error(f"❌ Error sending QR codes: {e}")
+    
+    async def _handle_renew_account(self, username, user_id):
         """Handle account renewal request"""
+        # Only names that exist on the panel become the user's default
+        if not await self._get_user_cached(username):
+            return TEMPLATES.render('user_not_found', username=username)
+        await self._remember_username(user_id, username, 'RENEW_ACCOUNT')
+        
         # This would typically involve payment processing
-        return f"""
-💳 **درخواست تمدید اکانت '{username}'**
-
-برای تمدید اکانت خود، لطفاً:
-1. مبلغ مورد نظر را واریز کنید
-2. فیش واریزی را ارسال کنید
-3. منتظر تأیید پشتیبانی باشید
-
-💰 **تعرفه‌ها:**
-• یک ماهه: 50,000 تومان
-• سه ماهه: 140,000 تومان
-• شش ماهه: 270,000 تومان
-
-📞 **پشتیبانی:** @support_username
-        """
+        return TEMPLATES.render('renew', username=username)
     
     def _format_user_info(self, user_info):
         """Format user information for display"""
@@ -266,18 +659,17 @@ class MarzbanAIBot:
         used_gb = user_info.get('used_traffic', 0) / (1024**3)
         limit_gb = user_info.get('data_limit', 0) / (1024**3) if user_info.get('data_limit') else 'نامحدود'
         
-        return f"""
-👤 **اطلاعات اکانت**
-
-🏷️ **نام کاربری:** {user_info.get('username')}
-{status_emoji} **وضعیت:** {user_info.get('status')}
-📊 **مصرف:** {used_gb:.2f} GB از {limit_gb} GB
-📅 **تاریخ ایجاد:** {user_info.get('created_at', 'نامشخص')}
-⏰ **انقضا:** {user_info.get('expire', 'نامحدود')}
-
-🔗 **لینک اشتراک:** 
-`{user_info.get('subscription_url', 'موجود نیست')}`
-        """
+        return TEMPLATES.render(
+            'user_info',
+            username=user_info.get('username'),
+            status_emoji=status_emoji,
+            status=user_info.get('status'),
+            used_gb=used_gb,
+            limit_gb=limit_gb,
+            created_at=user_info.get('created_at', 'نامشخص'),
+            expire=user_info.get('expire') or 'نامحدود',
+            subscription_url=user_info.get('subscription_url', 'موجود نیست')
+        )
     
     def _get_current_time(self):
         """Get current time in Persian format"""
@@ -288,18 +680,128 @@ class MarzbanAIBot:
         """Handle errors"""
         logger.error(f"Update {update} caused error {context.error}")
     
+    def _restore_caches(self):
+        """Warm the in-memory caches from the last persisted snapshot"""
+        self.user_cache.load(self.store.items('cache:user'))
+        self.ai_cache.load(self.store.items('cache:ai'))
+        analytics = self.store.get('analytics', 'state')
+        if analytics:
+            self.analytics.load(analytics)
+        logger.info(f"♨️ Restored {len(self.user_cache)} user and {len(self.ai_cache)} AI cache entries")
+    
+    def _snapshot_caches(self):
+        """Persist the current cache contents"""
+        # With shared state the caches also live there and survive restarts, and
+        # workers sharing a data volume would overwrite each other's snapshots
+        if not self.shared_state.is_shared:
+            self.store.replace_namespace('cache:user', self.user_cache.snapshot())
+            self.store.replace_namespace('cache:ai', self.ai_cache.snapshot())
+        self.store.set('analytics', 'state', self.analytics.snapshot())
+    
+    async def _analytics_loop(self):
+        """Refresh the usage aggregates from the panel periodically"""
+        while True:
+            try:
+                await self.analytics.refresh()
+            except Exception as e:
+                logger.error(f"❌ Analytics refresh failed: {e}")
+            await asyncio.sleep(self.analytics.refresh_interval)
+    
+    async def _snapshot_loop(self):
+        while True:
+            await asyncio.sleep(self.snapshot_interval)
+            self._snapshot_caches()
+    
+    @property
+    def is_ready(self):
+        return all(self.readiness.values())
+    
+    async def warm_up(self):
+        """Authenticate with the panel and load the AI providers concurrently"""
+        started = time.perf_counter()
+        
+        async def warm_marzban():
+            delay = 1
+            while not await self.marzban.warm_up():
+                logger.warning(f"⚠️ Marzban warm-up failed, retrying in {delay}s")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 60)
+            self.readiness['marzban'] = True
+        
+        async def warm_ai():
+            try:
+                await self.gemini.warm_up()
+                self.readiness['ai'] = True
+            except Exception as e:
+                logger.error(f"❌ AI warm-up failed: {e}")
+        
+        await asyncio.gather(warm_marzban(), warm_ai())
+        logger.info(f"♨️ Backends warmed up in {time.perf_counter() - started:.2f}s")
+    
     async def start(self):
         """Start the bot"""
         logger.info("🚀 Starting Telegram bot...")
+        await self.store.open()
+        self._restore_caches()
+        self.readiness['state'] = True
+        self._snapshot_task = asyncio.create_task(self._snapshot_loop())
+        
+        # Warm the backends while Telegram is being initialized
+        self._warm_up_task = asyncio.create_task(self.warm_up())
+        
         await self.app.initialize()
         await self.app.start()
-        await self.app.updater.start_polling()
+        if self.telegram_webhook_url:
+            # Every worker registers the same URL; the load balancer spreads updates
+            await self.app.updater.start_webhook(
+                listen='0.0.0.0',
+                port=self.telegram_webhook_port,
+                url_path='telegram',
+                webhook_url=f"{self.telegram_webhook_url.rstrip('/')}/telegram",
+                secret_token=self.telegram_webhook_secret
+            )
+            logger.info(f"📡 Receiving Telegram updates by webhook on port {self.telegram_webhook_port}")
+        else:
+            await self.app.updater.start_polling()
         
-        # Keep running indefinitely
-        while True:
-            await asyncio.sleep(1)
+        await self.bulk.resume(self.app.bot)
+        if self.analytics.refresh_interval > 0:
+            self._analytics_task = asyncio.create_task(self._analytics_loop())
+        self.readiness['telegram'] = True
+        logger.info("✅ Telegram bot started")
     
-    async def stop(self):
-        """Stop the bot"""
+    async def stop(self, timeout: float = 20):
+        """Stop the bot: stop intake, drain in-flight updates, persist state, close sessions"""
         logger.info("🛑 Stopping Telegram bot...")
-        await self.app.stop()
\ No newline at end of file
+        self.readiness['telegram'] = False
+        
+        # No new updates; updates already received are still handled by app.stop()
+        try:
+            if self.app.updater.running:
+                await self.app.updater.stop()
+            if self.app.running:
+                await asyncio.wait_for(self.app.stop(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"⚠️ In-flight updates not finished within {timeout}s, stopping anyway")
+        except Exception as e:
+            logger.error(f"❌ Error stopping Telegram application: {e}")
+        
+        # Background work; bulk jobs stay marked as running and resume on next start
+        await self.bulk.cancel_all()
+        tasks = [task for task in (self._warm_up_task, self._analytics_task, self._snapshot_task) if task]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        
+        # Persist state before closing connections
+        self._snapshot_caches()
+        await self.store.close()
+        
+        await self.marzban.close()
+        await self.shared_state.close()
+        self.qr_codes.close()
+        try:
+            await self.app.shutdown()
+        except Exception as e:
+            logger.error(f"❌ Error shutting down Telegram application: {e}")
+        logger.info("✅ Telegram bot stopped")
\ No newline at end of file
@@ -0,0 +1,303 @@
+import os
+import json
+import time
+import uuid
+import logging
+import asyncio
+from typing import Any, Dict, List
+
+from marzban_api import MarzbanAPI
+from shared_state import SharedStateBackend
+from state_store import StateStore
+
+logger = logging.getLogger(__name__)
+
+OPERATION_TITLES = {
+    'extend': 'تمدید {days} روزه',
+    'reset': 'ریست ترافیک',
+}
+
+class BulkOperationEngine:
+    """Run admin mutations over many panel users with bounded concurrency.
+
+    Targets and their absolute new values are planned and persisted before
+    the first mutation, and per-user results are kept in the state store, so
+    a job interrupted by a crash or redeploy resumes where it stopped and
+    re-applying a user only sets the same value again. With several workers
+    jobs, plans and results live in shared state instead, and a job runs on
+    whichever worker holds its lease.
+    """
+
+    def __init__(self, marzban: MarzbanAPI, store: StateStore, shared_state: SharedStateBackend):
+        self.marzban = marzban
+        self.store = store
+        self.shared_state = shared_state
+        self.concurrency = int(os.getenv('BULK_CONCURRENCY', '5'))
+        self.progress_interval = float(os.getenv('BULK_PROGRESS_INTERVAL', '3'))
+        self.lease_ttl = int(os.getenv('BULK_LEASE_TTL', '60'))
+        self.owner = uuid.uuid4().hex
+        self.tasks: Dict[str, asyncio.Task] = {}
+
+    async def start_job(self, bot, chat_id: int, message_id: int, operation: str, params: Dict[str, Any]) -> str:
+        """Create a job and start running it in the background"""
+        job_id = uuid.uuid4().hex[:8]
+        job = {
+            'id': job_id,
+            'operation': operation,
+            'params': params,
+            'chat_id': chat_id,
+            'message_id': message_id,
+            'status': 'running',
+            'created_at': int(time.time())
+        }
+        await self._save_job(job)
+        self._spawn(bot, job)
+        logger.info(f"📦 Bulk job {job_id} started: {operation} {params}")
+        return job_id
+
+    async def resume(self, bot):
+        """Restart jobs that were still running when the bot (or another worker) went down"""
+        for job in await self.running_jobs():
+            if job['id'] not in self.tasks:
+                logger.info(f"♻️ Resuming bulk job {job['id']}")
+                self._spawn(bot, job)
+
+    async def running_jobs(self) -> List[Dict[str, Any]]:
+        if self.shared_state.is_shared:
+            jobs = [json.loads(job) for job in (await self.shared_state.hgetall('bulk:jobs')).values()]
+        else:
+            jobs = self.store.items('bulk_jobs').values()
+        return [job for job in jobs if job['status'] == 'running']
+
+    # Storage: the local state store, or shared state when several workers run
+
+    async def _save_job(self, job: Dict[str, Any]):
+        if not self.shared_state.is_shared:
+            self.store.set('bulk_jobs', job['id'], job)
+        elif job['status'] == 'running':
+            await self.shared_state.hset('bulk:jobs', job['id'], json.dumps(job, ensure_ascii=False))
+        else:
+            await self.shared_state.hdel('bulk:jobs', job['id'])
+
+    async def _save_plan(self, job: Dict[str, Any], plan: Dict[str, Any]):
+        """Persist the plan, then mark the job planned, before the first mutation"""
+        job['planned'] = True
+        if self.shared_state.is_shared:
+            await self.shared_state.set_json(f"bulk:plan:{job['id']}", plan)
+            await self._save_job(job)
+        else:
+            self.store.replace_namespace(f"bulk_plan:{job['id']}", plan)
+            await self._save_job(job)
+            await self.store.flush()
+
+    async def _load_plan(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        if self.shared_state.is_shared:
+            return await self.shared_state.get_json(f"bulk:plan:{job['id']}") or {}
+        return self.store.items(f"bulk_plan:{job['id']}")
+
+    async def _load_results(self, job: Dict[str, Any]) -> Dict[str, str]:
+        if self.shared_state.is_shared:
+            return await self.shared_state.hgetall(f"bulk:results:{job['id']}")
+        return self.store.items(f"bulk_results:{job['id']}")
+
+    async def _save_result(self, job: Dict[str, Any], username: str, outcome: str):
+        if self.shared_state.is_shared:
+            await self.shared_state.hset(f"bulk:results:{job['id']}", username, outcome)
+        else:
+            self.store.set(f"bulk_results:{job['id']}", username, outcome)
+
+    async def _clear(self, job: Dict[str, Any]):
+        if self.shared_state.is_shared:
+            await self.shared_state.delete(f"bulk:plan:{job['id']}")
+            await self.shared_state.delete(f"bulk:results:{job['id']}")
+        else:
+            self.store.replace_namespace(f"bulk_results:{job['id']}", {})
+            self.store.replace_namespace(f"bulk_plan:{job['id']}", {})
+
+    def _spawn(self, bot, job: Dict[str, Any]):
+        task = asyncio.create_task(self._run_leased(bot, job))
+        self.tasks[job['id']] = task
+        task.add_done_callback(lambda _: self.tasks.pop(job['id'], None))
+
+    async def _plan(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        """Resolve every target and its absolute new value before anything is mutated.
+
+        Listing by status while mutating would skip users (an extended expired
+        user turns active and shifts the pages), and a relative change would be
+        applied twice if the job resumes after the call but before its outcome
+        was recorded. Values: the target expire for extend (0 when unlimited,
+        None when the user was not found), True for reset.
+        """
+        operation = job['operation']
+        usernames = job['params'].get('usernames')
+
+        if operation == 'reset':
+            return {username: True for username in usernames}
+
+        if operation == 'extend':
+            extend_by = job['params']['days'] * 24 * 60 * 60
+            now = int(time.time())
+
+            def target_expire(user):
+                if not user:
+                    return None
+                # Unlimited accounts have nothing to extend
+                return max(user['expire'], now) + extend_by if user.get('expire') else 0
+
+            if not usernames:
+                return {
+                    user['username']: target_expire(user)
+                    async for user in self.marzban.iter_users(status=job['params'].get('status'))
+                    if user.get('username')
+                }
+
+            semaphore = asyncio.Semaphore(self.concurrency)
+
+            async def fetch(username):
+                async with semaphore:
+                    return username, target_expire(await self.marzban.get_user(username))
+
+            return dict(await asyncio.gather(*(fetch(username) for username in usernames)))
+
+        raise ValueError(f"Unknown bulk operation: {operation}")
+
+    async def _run_leased(self, bot, job: Dict[str, Any]):
+        """Run a job only if no other worker holds it; renew the lease while running"""
+        lease_key = f"bulk:job:{job['id']}"
+        if not await self.shared_state.add_if_absent(lease_key, self.owner, ttl=self.lease_ttl):
+            logger.info(f"⏭️ Bulk job {job['id']} is running on another worker")
+            return
+
+        async def renew():
+            while True:
+                await asyncio.sleep(self.lease_ttl / 3)
+                await self.shared_state.set(lease_key, self.owner, ttl=self.lease_ttl)
+
+        renewer = asyncio.create_task(renew())
+        try:
+            await self._run(bot, job)
+        finally:
+            renewer.cancel()
+            # Released on shutdown too, so a restarted worker can resume right away
+            try:
+                await self.shared_state.delete(lease_key)
+            except Exception as e:
+                logger.warning(f"⚠️ Could not release lease of bulk job {job['id']}: {e}")
+
+    async def _run(self, bot, job: Dict[str, Any]):
+        results = await self._load_results(job)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        pending = set()
+        progress = {'last_edit': 0.0}
+
+        async def worker(username, value):
+            try:
+                outcome = await self._apply(job, username, value)
+            except Exception as e:
+                logger.error(f"❌ Bulk job {job['id']} failed for {username}: {e}")
+                outcome = 'failed'
+            finally:
+                semaphore.release()
+            results[username] = outcome
+            await self._save_result(job, username, outcome)
+            await self._report_progress(bot, job, results, progress)
+
+        try:
+            if not job.get('planned'):
+                # Write-ahead: the plan is persisted before the first mutation, so
+                # a resumed job re-applies the same absolute values
+                await self._save_plan(job, await self._plan(job))
+
+            for username, value in (await self._load_plan(job)).items():
+                if username in results:
+                    continue
+                # Acquiring before spawning keeps at most `concurrency` calls in flight
+                await semaphore.acquire()
+                task = asyncio.create_task(worker(username, value))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+
+            if pending:
+                await asyncio.gather(*pending)
+            job['status'] = 'finished'
+        except asyncio.CancelledError:
+            # Leave the job marked as running so it resumes on next start
+            for task in pending:
+                task.cancel()
+            raise
+        except Exception as e:
+            logger.error(f"❌ Bulk job {job['id']} aborted: {e}")
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+            job['status'] = 'aborted'
+
+        await self._save_job(job)
+        await self._report_progress(bot, job, results, progress, force=True)
+        if job['status'] == 'finished':
+            await self._clear(job)
+        logger.info(f"🏁 Bulk job {job['id']} {job['status']}")
+
+    async def _apply(self, job: Dict[str, Any], username: str, value) -> str:
+        """Apply the planned value to one user; returns done, skipped or failed"""
+        operation = job['operation']
+
+        if operation == 'reset':
+            result = await self.marzban.reset_user_traffic(username)
+            return 'done' if result else 'failed'
+
+        if operation == 'extend':
+            if value is None:
+                return 'failed'
+            if not value:
+                return 'skipped'
+            # Setting an absolute expire is safe to repeat after a resume
+            result = await self.marzban.modify_user(username, expire=value)
+            return 'done' if result else 'failed'
+
+        raise ValueError(f"Unknown bulk operation: {operation}")
+
+    def _format_progress(self, job: Dict[str, Any], results: Dict[str, str]) -> str:
+        counts = {'done': 0, 'skipped': 0, 'failed': 0}
+        for outcome in results.values():
+            counts[outcome] = counts.get(outcome, 0) + 1
+
+        status = {
+            'running': '⏳ در حال انجام',
+            'finished': '✅ پایان یافت',
+            'aborted': '❌ متوقف شد'
+        }.get(job['status'], job['status'])
+        title = OPERATION_TITLES.get(job['operation'], job['operation']).format(**job['params'])
+
+        return (
+            f"📦 عملیات گروهی {job['id']}: {title}\n"
+            f"وضعیت: {status}\n\n"
+            f"✅ انجام شده: {counts['done']}\n"
+            f"⏭️ رد شده: {counts['skipped']}\n"
+            f"❌ ناموفق: {counts['failed']}"
+        )
+
+    async def _report_progress(self, bot, job: Dict[str, Any], results: Dict[str, str], progress: Dict[str, float], force: bool = False):
+        """Edit the progress message, at most once per progress interval"""
+        now = time.monotonic()
+        if not force and now - progress['last_edit'] < self.progress_interval:
+            return
+        progress['last_edit'] = now
+        try:
+            await bot.edit_message_text(
+                chat_id=job['chat_id'],
+                message_id=job['message_id'],
+                text=self._format_progress(job, results)
+            )
+        except Exception as e:
+            # Typically "message is not modified"; progress is best effort
+            logger.debug(f"Progress update for bulk job {job['id']} skipped: {e}")
+
+    async def cancel_all(self):
+        """Stop running jobs; they resume on next start"""
+        tasks = list(self.tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def describe(self, job: Dict[str, Any]) -> str:
+        return self._format_progress(job, await self._load_results(job))
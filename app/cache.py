@@ -0,0 +1,102 @@
+import time
+from collections import OrderedDict, deque
+from typing import Any, Dict, Optional
+
+class TTLCache:
+    """Small LRU cache with per-entry expiry.
+
+    Expiry uses wall-clock time so a snapshot taken before a restart can be
+    loaded back afterwards without resurrecting stale entries.
+    """
+
+    def __init__(self, ttl: float, max_size: int = 1024):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[Any]:
+        """Get a value, or None if missing or expired"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        """Store a value, evicting the least recently used entry if full"""
+        self._entries[key] = (time.time() + (ttl if ttl is not None else self.ttl), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key: str):
+        """Drop a single entry"""
+        self._entries.pop(key, None)
+
+    def snapshot(self) -> Dict[str, list]:
+        """Export live entries as a JSON-serializable mapping"""
+        now = time.time()
+        return {
+            key: [expires_at, value]
+            for key, (expires_at, value) in self._entries.items()
+            if expires_at >= now
+        }
+
+    def load(self, snapshot: Dict[str, list]):
+        """Import entries from a snapshot, skipping expired ones"""
+        now = time.time()
+        for key, (expires_at, value) in snapshot.items():
+            if expires_at >= now:
+                self._entries[key] = (expires_at, value)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+
+class SeenEventIndex:
+    """Fixed-memory set of recently seen event IDs.
+
+    IDs are grouped in time buckets of window / buckets seconds and whole
+    buckets expire at once, so there is no per-entry bookkeeping and a lookup
+    checks a handful of sets. An ID is kept for at least window seconds (up to
+    one step longer). When max_size is reached the oldest bucket is
+    dropped early, which bounds memory under a flood of distinct IDs.
+    """
+
+    def __init__(self, window: float, buckets: int = 12, max_size: int = 100000):
+        self.window = window
+        self.step = window / buckets
+        self.buckets = buckets
+        self.max_size = max_size
+        self._buckets: "deque[tuple]" = deque()
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def _expire(self, bucket: int):
+        while self._buckets and (
+            self._buckets[0][0] < bucket - self.buckets or self._size >= self.max_size
+        ):
+            _, ids = self._buckets.popleft()
+            self._size -= len(ids)
+
+    def add(self, event_id: str, now: Optional[float] = None) -> bool:
+        """Record an ID; False if it was already seen within the window"""
+        bucket = int((time.time() if now is None else now) // self.step)
+        self._expire(bucket)
+        for _, ids in self._buckets:
+            if event_id in ids:
+                return False
+
+        if not self._buckets or self._buckets[-1][0] != bucket:
+            self._buckets.append((bucket, set()))
+        self._buckets[-1][1].add(event_id)
+        self._size += 1
+        return True
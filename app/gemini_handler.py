@@ -1,20 +1,30 @@
 import os
 import json
+import asyncio
 import logging
-import google.generativeai as genai
-from typing import Dict, Any
+from typing import Dict, Any, Optional
+
+from llm_backends import create_backends, timed_generate
 
 logger = logging.getLogger(__name__)
 
 class GeminiHandler:
     def __init__(self):
         self.api_key = os.getenv('GEMINI_API_KEY')
-        if not self.api_key:
-            raise ValueError("GEMINI_API_KEY environment variable is required")
         
-        # Configure Gemini
-        genai.configure(api_key=self.api_key)
-        self.model = genai.GenerativeModel('gemini-1.5-flash')
+        # Ordered providers: the first is asked, later ones are hedges/failovers
+        self.providers = create_backends(
+            os.getenv('LLM_PROVIDERS', 'gemini:gemini-1.5-flash,rules'),
+            self.api_key,
+            lambda message: self._create_fallback_response(message, '')
+        )
+        self.hedge_percentile = float(os.getenv('LLM_HEDGE_PERCENTILE', '95'))
+        self.hedge_default_delay = float(os.getenv('LLM_HEDGE_DEFAULT_DELAY', '3'))
+        self.hedge_min_delay = float(os.getenv('LLM_HEDGE_MIN_DELAY', '0.5'))
+        self.timeout = float(os.getenv('LLM_TIMEOUT', '30'))
+        # Hedge losers left running only to time them
+        self._stragglers = set()
+        self.hedges = 0
         
         # System prompt for customer support
         self.system_prompt = """
@@ -52,76 +62,153 @@ class GeminiHandler:
         
         logger.info("🧠 Gemini AI handler initialized")
     
-    def check_status(self) -> bool:
-        """Check if Gemini AI is working"""
+    async def warm_up(self):
+        """Load every provider in the background so no user waits for it"""
+        await asyncio.gather(*(provider.warm_up() for provider in self.providers))
+    
+    async def check_status(self) -> bool:
+        """Check if the primary AI provider is working"""
         try:
             # Simple test generation
-            response = self.model.generate_content("سلام")
-            return bool(response.text)
+            text = await asyncio.wait_for(self.providers[0].generate("سلام", "سلام"), self.timeout)
+            return bool(text)
         except Exception as e:
             logger.error(f"❌ Gemini status check failed: {e}")
             return False
     
-    async def process_message(self, message: str) -> Dict[str, Any]:
-        """Process user message with Gemini AI"""
+    def _hedge_delay(self, provider) -> float:
+        """How long to wait for a provider before hedging to the next one"""
+        observed = provider.latency_percentile(self.hedge_percentile)
+        if observed is None:
+            return self.hedge_default_delay
+        return max(self.hedge_min_delay, observed)
+    
+    def _finish_in_background(self, task: asyncio.Task, give_up_at: float):
+        """Let a hedge loser run until the overall timeout so its latency is recorded.
+        
+        Cancelling it would only ever record latencies below the current deadline,
+        pulling every following deadline lower until the fastest hedge always wins.
+        """
+        async def drain():
+            try:
+                await asyncio.wait_for(task, max(0, give_up_at - asyncio.get_running_loop().time()))
+            except (Exception, asyncio.CancelledError):
+                pass
+        
+        straggler = asyncio.create_task(drain())
+        self._stragglers.add(straggler)
+        straggler.add_done_callback(self._stragglers.discard)
+    
+    def _parse_response(self, response_text: str) -> Optional[Dict[str, Any]]:
+        """Parse a provider's JSON answer, or return None if it is not valid"""
         try:
-            # Create full prompt
-            full_prompt = f"""
+            # Clean the response text
+            response_text = response_text.strip()
+            
+            # Try to extract JSON from markdown code blocks if present
+            if "```json" in response_text:
+                start = response_text.find("```json") + 7
+                end = response_text.find("```", start)
+                if end != -1:
+                    response_text = response_text[start:end].strip()
+            elif "```" in response_text:
+                start = response_text.find("```") + 3
+                end = response_text.find("```", start)
+                if end != -1:
+                    response_text = response_text[start:end].strip()
+            
+            result = json.loads(response_text)
+            
+            # Validate response structure
+            if not isinstance(result, dict) or 'response' not in result:
+                raise ValueError("Invalid response structure")
+            
+            # Set defaults
+            result.setdefault('action', 'NONE')
+            result.setdefault('parameters', {})
+            result.setdefault('confidence', 0.8)
+            return result
+            
+        except (json.JSONDecodeError, ValueError) as e:
+            logger.warning(f"⚠️ Failed to parse AI response as JSON: {e}")
+            return None
+    
+    async def process_message(self, message: str) -> Dict[str, Any]:
+        """Process user message, hedging slow providers with the next one in line"""
+        # Create full prompt
+        full_prompt = f"""
 {self.system_prompt}
 
 **پیام کاربر:** "{message}"
 
 لطفاً پاسخ مناسب را در قالب JSON ارائه دهید.
-            """
-            
-            # Generate response
-            response = self.model.generate_content(full_prompt)
-            
-            if not response.text:
-                return self._fallback_response("متأسفانه نتوانستم پیام شما را پردازش کنم.")
+        """
+        
+        tasks = {}
+        next_provider = 0
+        # A non-JSON answer, used only if no provider gives a structured one
+        unstructured = None
+        loop = asyncio.get_running_loop()
+        give_up_at = loop.time() + self.timeout
+        
+        def launch():
+            nonlocal next_provider
+            provider = self.providers[next_provider]
+            next_provider += 1
+            task = asyncio.create_task(timed_generate(provider, full_prompt, message))
+            tasks[task] = provider
+            return provider
+        
+        try:
+            deadline = loop.time() + self._hedge_delay(launch())
             
-            # Try to parse JSON response
-            try:
-                # Clean the response text
-                response_text = response.text.strip()
-                
-                # Try to extract JSON from markdown code blocks if present
-                if "```json" in response_text:
-                    start = response_text.find("```json") + 7
-                    end = response_text.find("```", start)
-                    if end != -1:
-                        response_text = response_text[start:end].strip()
-                elif "```" in response_text:
-                    start = response_text.find("```") + 3
-                    end = response_text.find("```", start)
-                    if end != -1:
-                        response_text = response_text[start:end].strip()
-                
-                result = json.loads(response_text)
-                
-                # Validate response structure
-                if not isinstance(result, dict) or 'response' not in result:
-                    raise ValueError("Invalid response structure")
+            while tasks:
+                more_providers = next_provider < len(self.providers)
+                wait_until = min(deadline, give_up_at) if more_providers else give_up_at
+                done, _ = await asyncio.wait(
+                    tasks, timeout=max(0, wait_until - loop.time()), return_when=asyncio.FIRST_COMPLETED
+                )
                 
-                # Set defaults
-                result.setdefault('action', 'NONE')
-                result.setdefault('parameters', {})
-                result.setdefault('confidence', 0.8)
+                for task in done:
+                    provider = tasks.pop(task)
+                    try:
+                        text = task.result()
+                    except Exception as e:
+                        logger.warning(f"⚠️ Provider {provider.name} failed: {e}")
+                        continue
+                    
+                    if not text:
+                        continue
+                    
+                    # The first valid structured answer wins
+                    result = self._parse_response(text)
+                    if result is None:
+                        unstructured = unstructured or text
+                        continue
+                    logger.info(f"🧠 {provider.name} processed message with action: {result.get('action')}")
+                    return result
                 
-                logger.info(f"🧠 AI processed message with action: {result.get('action')}")
-                return result
+                if loop.time() >= give_up_at:
+                    logger.warning("⚠️ AI providers timed out")
+                    break
                 
-            except (json.JSONDecodeError, ValueError) as e:
-                logger.warning(f"⚠️ Failed to parse AI response as JSON: {e}")
-                # Use fallback with rule-based detection
-                return self._create_fallback_response(message, response.text)
-                
-        except Exception as e:
-            logger.error(f"❌ Error processing message with Gemini: {e}")
-            return self._fallback_response(
-                "متأسفانه در حال حاضر مشکلی در سیستم هوش مصنوعی وجود دارد. "
-                "لطفاً دوباره تلاش کنید یا با پشتیبانی تماس بگیرید."
-            )
+                # Hedge when the deadline passed, fail over when nothing is left in flight
+                if more_providers and (not tasks or loop.time() >= deadline):
+                    provider = launch()
+                    self.hedges += 1
+                    logger.info(f"🔀 Hedging AI request to {provider.name}")
+                    deadline = loop.time() + self._hedge_delay(provider)
+        finally:
+            for task in tasks:
+                self._finish_in_background(task, give_up_at)
+        
+        if unstructured:
+            # A non-JSON answer is still usable with rule-based intent detection
+            return self._create_fallback_response(message, unstructured)
+        return self._fallback_response(
+            "متأسفانه در حال حاضر مشکلی در سیستم هوش مصنوعی وجود دارد. "
+            "لطفاً دوباره تلاش کنید یا با پشتیبانی تماس بگیرید."
+        )
     
     def _fallback_response(self, text: str) -> Dict[str, Any]:
         """Create fallback response when AI processing fails"""
@@ -141,9 +228,6 @@ class GeminiHandler:
             response_text = """
 سلام! 😊
 درخواست شما برای ایجاد اکانت جدید دریافت شد.
-لطفاً با پشتیبانی تماس بگیرید تا اکانت شما ایجاد شود.
-
-📞 پشتیبانی: @support_username
             """
         elif action == 'CHECK_ACCOUNT':
             response_text = """
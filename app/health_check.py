@@ -1,6 +1,10 @@
 #!/usr/bin/env python3
 """
 Health check script for Docker container
+
+By default only liveness is checked, so a slow panel or AI backend does not
+get the container restarted. Pass --ready to also require every backend to
+be warmed up (e.g. before routing traffic to a new worker).
 """
 
 import sys
@@ -8,23 +12,32 @@ import asyncio
 import aiohttp
 import os
 
-async def check_health():
+async def check_health(require_ready: bool = False):
     """Check if the bot services are healthy"""
     try:
+        port = os.getenv('WEBHOOK_PORT', '8080')
         # Check webhook server
         async with aiohttp.ClientSession() as session:
-            async with session.get('http://localhost:8080/health', timeout=5) as response:
+            async with session.get(f'http://localhost:{port}/health', timeout=5) as response:
                 if response.status != 200:
                     print("❌ Webhook server health check failed")
                     return False
-        
+                health = await response.json()
+
+        components = health.get('components', {})
+        pending = [name for name, ready in components.items() if not ready]
+        if pending:
+            print(f"⏳ Still warming up: {', '.join(pending)}")
+            if require_ready:
+                return False
+
         print("✅ All services healthy")
         return True
-        
+
     except Exception as e:
         print(f"❌ Health check failed: {e}")
         return False
 
 if __name__ == "__main__":
-    result = asyncio.run(check_health())
-    sys.exit(0 if result else 1)
\ No newline at end of file
+    result = asyncio.run(check_health('--ready' in sys.argv[1:]))
+    sys.exit(0 if result else 1)
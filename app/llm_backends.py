@@ -0,0 +1,111 @@
+import os
+import json
+import time
+import asyncio
+import logging
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import Any, Callable, Dict, List
+
+logger = logging.getLogger(__name__)
+
+class LLMBackend(ABC):
+    """A provider that turns a prompt into raw response text.
+
+    Backends return the text as-is; GeminiHandler parses and validates it,
+    so every provider's answer goes through the same JSON checks.
+    """
+
+    name = 'base'
+
+    def __init__(self):
+        # Recent latencies, used to pick the hedging deadline; calls that lost a
+        # hedge are still timed to completion so the samples are not cut off there
+        self.latencies = deque(maxlen=int(os.getenv('LLM_LATENCY_WINDOW', '200')))
+
+    async def warm_up(self):
+        """Prepare the backend so the first request does not pay for setup"""
+
+    @abstractmethod
+    async def generate(self, prompt: str, message: str) -> str:
+        raise NotImplementedError
+
+    def record_latency(self, seconds: float):
+        self.latencies.append(seconds)
+
+    def latency_percentile(self, percentile: float, min_samples: int = 20):
+        """Latency at the given percentile, or None until enough samples exist"""
+        if len(self.latencies) < min_samples:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * percentile / 100))]
+
+class GeminiBackend(LLMBackend):
+    """Google Gemini model, loaded on first use or by warm_up"""
+
+    def __init__(self, api_key: str, model_name: str):
+        super().__init__()
+        self.name = f"gemini:{model_name}"
+        self.api_key = api_key
+        self.model_name = model_name
+        self.model = None
+
+    def _load_model(self):
+        # google.generativeai pulls in grpc and protobuf, which dominate
+        # startup time, so it is imported here rather than at module level
+        import google.generativeai as genai
+
+        genai.configure(api_key=self.api_key)
+        return genai.GenerativeModel(self.model_name)
+
+    async def warm_up(self):
+        if self.model is None:
+            self.model = await asyncio.to_thread(self._load_model)
+
+    async def generate(self, prompt: str, message: str) -> str:
+        await self.warm_up()
+        response = await self.model.generate_content_async(prompt)
+        return response.text
+
+class RuleBasedBackend(LLMBackend):
+    """Local keyword classifier; instant and always available"""
+
+    name = 'rules'
+
+    def __init__(self, classify: Callable[[str], Dict[str, Any]]):
+        super().__init__()
+        self.classify = classify
+
+    async def generate(self, prompt: str, message: str) -> str:
+        return json.dumps(self.classify(message), ensure_ascii=False)
+
+def create_backends(spec: str, api_key: str, classify: Callable[[str], Dict[str, Any]]) -> List[LLMBackend]:
+    """Build the ordered provider list from a spec like 'gemini:gemini-1.5-flash,rules'"""
+    backends = []
+    for entry in [part.strip() for part in spec.split(',') if part.strip()]:
+        kind, _, model_name = entry.partition(':')
+        if kind == 'gemini':
+            if not api_key:
+                raise ValueError("GEMINI_API_KEY environment variable is required")
+            backends.append(GeminiBackend(api_key, model_name or 'gemini-1.5-flash'))
+        elif kind == 'rules':
+            backends.append(RuleBasedBackend(classify))
+        else:
+            raise ValueError(f"Unknown LLM provider: {entry}")
+
+    if not backends:
+        raise ValueError("LLM_PROVIDERS must list at least one provider")
+    logger.info(f"🧠 LLM providers: {', '.join(backend.name for backend in backends)}")
+    return backends
+
+async def timed_generate(backend: LLMBackend, prompt: str, message: str) -> str:
+    """Call a backend and record its latency on success or cancellation"""
+    started = time.perf_counter()
+    try:
+        text = await backend.generate(prompt, message)
+    except asyncio.CancelledError:
+        # Cancelled at the overall timeout: the real latency is at least this
+        backend.record_latency(time.perf_counter() - started)
+        raise
+    backend.record_latency(time.perf_counter() - started)
+    return text
@@ -7,6 +7,7 @@ A Telegram bot with Gemini AI integration for Marzban panel customer support
 import asyncio
 import logging
 import os
+import signal
 from dotenv import load_dotenv
 
 from bot_handler import MarzbanAIBot
@@ -29,6 +30,10 @@ logger = logging.getLogger(__name__)
 
 async def main():
     """Main function to start the bot and webhook server"""
+    loop = asyncio.get_running_loop()
+    stop_event = asyncio.Event()
+    shutdown_timeout = float(os.getenv('SHUTDOWN_TIMEOUT', '20'))
+    
     try:
         logger.info("🚀 Starting Marzban AI Bot...")
         
@@ -38,12 +43,37 @@ async def main():
         # Initialize webhook server for Marzban events
         webhook_server = WebhookServer(bot)
         
+        def reload_config():
+            logger.info("🔄 SIGHUP received, reloading configuration...")
+            try:
+                # CONFIG_FILE points into a mounted directory so edits saved by
+                # rename (e.g. vim) are seen; a single-file mount goes stale
+                load_dotenv(os.getenv('CONFIG_FILE') or None, override=True)
+                bot.reload_config()
+            except Exception as e:
+                logger.error(f"❌ Failed to reload configuration: {e}")
+        
+        # SIGTERM (docker stop) and SIGINT drain and exit, SIGHUP reloads
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, stop_event.set)
+        loop.add_signal_handler(signal.SIGHUP, reload_config)
+        
         # Start both services
         await asyncio.gather(
             bot.start(),
             webhook_server.start()
         )
         
+        await stop_event.wait()
+        logger.info("🛑 Shutdown signal received, draining...")
+        
+        # One deadline for both, so the whole drain fits in SHUTDOWN_TIMEOUT and
+        # state is persisted before Docker's stop_grace_period runs out.
+        # Webhooks first: they may still need the bot's sessions
+        deadline = loop.time() + shutdown_timeout
+        await webhook_server.stop(shutdown_timeout)
+        await bot.stop(max(0, deadline - loop.time()))
+        
     except Exception as e:
         logger.error(f"❌ Failed to start bot: {e}")
         raise
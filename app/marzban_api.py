@@ -1,18 +1,23 @@
 import os
 import aiohttp
 import logging
-from typing import Optional, Dict, Any
+from urllib.parse import urlencode
+from typing import Optional, Dict, Any, AsyncIterator
 
 logger = logging.getLogger(__name__)
 
 class MarzbanAPI:
-    def __init__(self):
+    def __init__(self, shared_state=None):
         self.base_url = os.getenv('MARZBAN_URL').rstrip('/')
         self.username = os.getenv('MARZBAN_USERNAME')
         self.password = os.getenv('MARZBAN_PASSWORD')
         self.token = None
         self.session = None
         
+        # Token shared between workers so only one of them logs in
+        self.shared_state = shared_state
+        self.token_ttl = int(os.getenv('MARZBAN_TOKEN_TTL', '3600'))
+        
         logger.info(f"🔗 Marzban API initialized for {self.base_url}")
     
     async def _get_session(self):
@@ -40,6 +45,8 @@ class MarzbanAPI:
                 if response.status == 200:
                     data = await response.json()
                     self.token = data.get('access_token')
+                    if self.shared_state and self.token:
+                        await self.shared_state.set('marzban:token', self.token, ttl=self.token_ttl)
                     logger.info("✅ Successfully authenticated with Marzban")
                     return True
                 else:
@@ -50,9 +57,19 @@ class MarzbanAPI:
             logger.error(f"❌ Authentication error: {e}")
             return False
     
+    async def _load_shared_token(self) -> bool:
+        """Adopt a token another worker already obtained, if it differs from ours"""
+        if not self.shared_state:
+            return False
+        token = await self.shared_state.get('marzban:token')
+        if token and token != self.token:
+            self.token = token
+            return True
+        return False
+    
     async def _make_request(self, method: str, endpoint: str, data: Optional[Dict] = None):
         """Make authenticated request to Marzban API"""
-        if not self.token:
+        if not self.token and not await self._load_shared_token():
             if not await self._authenticate():
                 return None
         
@@ -68,7 +85,7 @@ class MarzbanAPI:
             async with session.request(method, url, json=data, headers=headers) as response:
                 if response.status == 401:  # Token expired
                     logger.info("🔄 Token expired, re-authenticating...")
-                    if await self._authenticate():
+                    if await self._load_shared_token() or await self._authenticate():
                         headers['Authorization'] = f'Bearer {self.token}'
                         async with session.request(method, url, json=data, headers=headers) as retry_response:
                             if retry_response.status == 200:
@@ -85,6 +102,12 @@ class MarzbanAPI:
             logger.error(f"❌ Request error: {e}")
             return None
     
+    async def warm_up(self) -> bool:
+        """Log in and open a pooled connection before the first user request"""
+        if self.token or await self._load_shared_token():
+            return await self.check_connection()
+        return await self._authenticate()
+    
     async def check_connection(self) -> bool:
         """Check if connection to Marzban is working"""
         try:
@@ -104,6 +127,27 @@ class MarzbanAPI:
             logger.error(f"❌ Error getting user {username}: {e}")
             return None
     
+    async def iter_users(self, status: Optional[str] = None, page_size: int = 100) -> AsyncIterator[Dict[str, Any]]:
+        """Stream all users page by page instead of loading them at once"""
+        offset = 0
+        while True:
+            params = {'offset': offset, 'limit': page_size}
+            if status:
+                params['status'] = status
+            result = await self._make_request('GET', f'/api/users?{urlencode(params)}')
+            if not result:
+                # Stopping silently would look like the end of the list
+                logger.error(f"❌ Error listing users at offset {offset}")
+                raise RuntimeError("Failed to list users from Marzban")
+            
+            users = result.get('users', [])
+            for user in users:
+                yield user
+            
+            offset += len(users)
+            if len(users) < page_size or offset >= result.get('total', offset):
+                return
+    
     async def create_user(self, username: str, data_limit: int = 10737418240, expire_days: int = 30) -> Optional[Dict[str, Any]]:
         """Create a new user"""
         try:
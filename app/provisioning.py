@@ -0,0 +1,107 @@
+import os
+import time
+import logging
+import asyncio
+from typing import Any, Dict, Optional, Tuple
+
+from marzban_api import MarzbanAPI
+from state_store import StateStore
+from shared_state import SharedStateBackend
+
+logger = logging.getLogger(__name__)
+
+class ProvisioningInProgress(Exception):
+    """Another worker is creating the account for this Telegram user"""
+
+class AccountProvisioner:
+    """Create one panel account per Telegram user.
+
+    The panel username is derived from the Telegram user ID, so it is unique
+    without asking the panel first, and the provisioning record keyed by the
+    Telegram user ID doubles as the idempotency key: repeated requests return
+    the account that already exists instead of creating another one.
+    """
+
+    def __init__(self, marzban: MarzbanAPI, store: StateStore, shared_state: SharedStateBackend):
+        self.marzban = marzban
+        self.store = store
+        self.shared_state = shared_state
+        self.prefix = os.getenv('PROVISION_USERNAME_PREFIX', 'tg')
+        self.data_limit = int(float(os.getenv('PROVISION_DATA_LIMIT_GB', '10')) * 1024**3)
+        self.expire_days = int(os.getenv('PROVISION_EXPIRE_DAYS', '30'))
+        # Per-user locks, dropped once no request holds or waits on them
+        self._locks: Dict[int, asyncio.Lock] = {}
+        self._lock_users: Dict[int, int] = {}
+
+    def username_for(self, user_id: int) -> str:
+        """Panel username for a Telegram user"""
+        return f"{self.prefix}{user_id}"
+
+    def get_record(self, user_id: int) -> Optional[Dict[str, Any]]:
+        """Get the finished provisioning record for a Telegram user, if any"""
+        record = self.store.get('provisioning', str(user_id))
+        return record if record and record.get('status') == 'done' else None
+
+    async def provision(self, user_id: int) -> Tuple[Optional[Dict[str, Any]], bool]:
+        """Provision an account; returns (record, created) with record None on failure"""
+        timings = {}
+        started = time.perf_counter()
+
+        # Double taps inside this worker wait here and then find the finished record
+        lock = self._locks.setdefault(user_id, asyncio.Lock())
+        self._lock_users[user_id] = self._lock_users.get(user_id, 0) + 1
+        try:
+            async with lock:
+                timings['lock'] = time.perf_counter() - started
+
+                record = self.get_record(user_id)
+                if record:
+                    return record, False
+
+                # Double taps routed to another worker are turned away
+                claim_key = f"provision:{user_id}"
+                if not await self.shared_state.add_if_absent(claim_key, ttl=60):
+                    raise ProvisioningInProgress()
+
+                try:
+                    record, created = await self._create(user_id, timings)
+                finally:
+                    await self.shared_state.delete(claim_key)
+        finally:
+            self._lock_users[user_id] -= 1
+            if not self._lock_users[user_id]:
+                del self._lock_users[user_id]
+                del self._locks[user_id]
+
+        timings['total'] = time.perf_counter() - started
+        steps = ', '.join(f"{step}={seconds * 1000:.0f}ms" for step, seconds in timings.items())
+        logger.info(f"⏱️ Provisioning for {user_id}: {steps}")
+        return record, created
+
+    async def _create(self, user_id: int, timings: Dict[str, float]) -> Tuple[Optional[Dict[str, Any]], bool]:
+        username = self.username_for(user_id)
+
+        step = time.perf_counter()
+        user_info = await self.marzban.create_user(username, data_limit=self.data_limit, expire_days=self.expire_days)
+        timings['create'] = time.perf_counter() - step
+
+        created = user_info is not None
+        if not created:
+            # The account already exists if an earlier attempt crashed after
+            # creating it, or another worker without this record created it
+            step = time.perf_counter()
+            user_info = await self.marzban.get_user(username)
+            timings['recover'] = time.perf_counter() - step
+            if not user_info:
+                logger.error(f"❌ Provisioning failed for Telegram user {user_id}")
+                return None, False
+
+        record = {
+            'status': 'done',
+            'username': username,
+            'subscription_url': user_info.get('subscription_url'),
+            'created_at': int(time.time())
+        }
+        self.store.set('provisioning', str(user_id), record)
+        logger.info(f"🆕 Provisioned {username} for Telegram user {user_id}")
+        return record, created
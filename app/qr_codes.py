@@ -0,0 +1,82 @@
+import os
+import io
+import hashlib
+import importlib.util
+import logging
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Tuple, Union
+
+from state_store import StateStore
+
+logger = logging.getLogger(__name__)
+
+def render_qr_png(content: str) -> bytes:
+    """Render content as a PNG QR code (runs in a worker process)"""
+    import qrcode
+
+    qr = qrcode.QRCode(error_correction=qrcode.constants.ERROR_CORRECT_M, box_size=8, border=2)
+    qr.add_data(content)
+    qr.make(fit=True)
+
+    buffer = io.BytesIO()
+    qr.make_image(fill_color="black", back_color="white").save(buffer, format='PNG')
+    return buffer.getvalue()
+
+class QRCodeService:
+    """QR code images for subscription links.
+
+    Images are keyed by a hash of their content. Rendered PNGs are kept in a
+    small LRU, and once Telegram has stored an upload its file_id is
+    persisted so the same code is re-sent without rendering or uploading.
+    """
+
+    def __init__(self, store: StateStore):
+        self.store = store
+        self.workers = int(os.getenv('QR_WORKERS', '2'))
+        self.max_cached_images = int(os.getenv('QR_CACHE_SIZE', '256'))
+        self._images: "OrderedDict[str, bytes]" = OrderedDict()
+        self._executor = None
+
+        # Only check availability; qrcode and PIL are imported by the workers
+        self.enabled = importlib.util.find_spec('qrcode') is not None
+        if not self.enabled:
+            logger.warning("⚠️ 'qrcode' package is not installed, QR codes are disabled")
+
+    @staticmethod
+    def content_hash(content: str) -> str:
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+    async def get_photo(self, content: str) -> Tuple[str, Union[str, bytes]]:
+        """Return (content hash, photo) where photo is a Telegram file_id or PNG bytes"""
+        key = self.content_hash(content)
+
+        file_id = self.store.get('qr_file_ids', key)
+        if file_id:
+            return key, file_id
+
+        image = self._images.get(key)
+        if image is None:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            loop = asyncio.get_running_loop()
+            image = await loop.run_in_executor(self._executor, render_qr_png, content)
+            self._images[key] = image
+            while len(self._images) > self.max_cached_images:
+                self._images.popitem(last=False)
+        else:
+            self._images.move_to_end(key)
+        return key, image
+
+    def remember_file_id(self, key: str, file_id: Optional[str]):
+        """Record the file_id Telegram assigned to an uploaded image"""
+        if file_id:
+            self.store.set('qr_file_ids', key, file_id)
+            # Future sends use the file_id, the PNG is no longer needed
+            self._images.pop(key, None)
+
+    def close(self):
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,28 @@
+import os
+import time
+import logging
+
+from shared_state import SharedStateBackend
+
+logger = logging.getLogger(__name__)
+
+class RateLimiter:
+    """Fixed-window per-user message limiter backed by shared state"""
+
+    def __init__(self, backend: SharedStateBackend):
+        self.backend = backend
+        self.configure()
+
+    def configure(self):
+        """(Re)load limits from the environment"""
+        self.limit = int(os.getenv('RATE_LIMIT_MESSAGES', '20'))
+        self.window = int(os.getenv('RATE_LIMIT_WINDOW', '60'))
+        logger.info(f"🚦 Rate limit: {self.limit} messages per {self.window}s")
+
+    async def allow(self, user_id: int) -> bool:
+        """Count a message from user_id and return whether it is allowed"""
+        if self.limit <= 0:
+            return True
+        bucket = int(time.time() // self.window)
+        count = await self.backend.incr(f"ratelimit:{user_id}:{bucket}", ttl=self.window * 2)
+        return count <= self.limit
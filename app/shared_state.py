@@ -0,0 +1,193 @@
+import os
+import json
+import time
+import logging
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+class SharedStateBackend(ABC):
+    """Key/value state shared by every bot worker.
+
+    Values are strings; every operation maps onto basic Redis commands so
+    any Redis-compatible server (or a local stand-in) works.
+    """
+
+    # True when other processes can see what this backend stores
+    is_shared = False
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[str]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def set(self, key: str, value: str, ttl: Optional[int] = None):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def delete(self, key: str):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def add_if_absent(self, key: str, value: str = '1', ttl: Optional[int] = None) -> bool:
+        """Set key only if it does not exist; return True if it was set"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def incr(self, key: str, ttl: int) -> int:
+        """Increment a counter that expires ttl seconds after its creation"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def hset(self, key: str, field: str, value: str):
+        """Set one field of a hash (no expiry)"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def hgetall(self, key: str) -> Dict[str, str]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def hdel(self, key: str, field: str):
+        raise NotImplementedError
+
+    async def get_json(self, key: str) -> Optional[Any]:
+        value = await self.get(key)
+        return json.loads(value) if value is not None else None
+
+    async def set_json(self, key: str, value: Any, ttl: Optional[int] = None):
+        await self.set(key, json.dumps(value, ensure_ascii=False), ttl)
+
+    async def close(self):
+        pass
+
+class MemoryBackend(SharedStateBackend):
+    """Process-local backend used when only one worker is running"""
+
+    def __init__(self):
+        self._entries: Dict[str, Tuple[Optional[float], str]] = {}
+        self._hashes: Dict[str, Dict[str, str]] = {}
+        self._last_purge = time.monotonic()
+
+    def _live(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at is not None and expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        return value
+
+    def _purge_expired(self):
+        # Expired keys that are never read again would otherwise pile up
+        now = time.monotonic()
+        if now - self._last_purge < 60:
+            return
+        self._last_purge = now
+        expired = [key for key, (expires_at, _) in self._entries.items() if expires_at is not None and expires_at < now]
+        for key in expired:
+            del self._entries[key]
+
+    def _store(self, key: str, value: str, ttl: Optional[int]):
+        self._purge_expired()
+        self._entries[key] = (time.monotonic() + ttl if ttl else None, value)
+
+    async def get(self, key: str) -> Optional[str]:
+        return self._live(key)
+
+    async def set(self, key: str, value: str, ttl: Optional[int] = None):
+        self._store(key, value, ttl)
+
+    async def delete(self, key: str):
+        self._entries.pop(key, None)
+        self._hashes.pop(key, None)
+
+    async def add_if_absent(self, key: str, value: str = '1', ttl: Optional[int] = None) -> bool:
+        if self._live(key) is not None:
+            return False
+        self._store(key, value, ttl)
+        return True
+
+    async def incr(self, key: str, ttl: int) -> int:
+        current = self._live(key)
+        if current is None:
+            self._store(key, '1', ttl)
+            return 1
+        expires_at, _ = self._entries[key]
+        count = int(current) + 1
+        self._entries[key] = (expires_at, str(count))
+        return count
+
+    async def hset(self, key: str, field: str, value: str):
+        self._hashes.setdefault(key, {})[field] = value
+
+    async def hgetall(self, key: str) -> Dict[str, str]:
+        return dict(self._hashes.get(key, {}))
+
+    async def hdel(self, key: str, field: str):
+        self._hashes.get(key, {}).pop(field, None)
+
+class RedisBackend(SharedStateBackend):
+    """Backend for Redis or any server speaking the same commands"""
+
+    is_shared = True
+
+    def __init__(self, client, prefix: str = 'marzban-bot:'):
+        # client is a redis.asyncio.Redis created with decode_responses=True
+        self.client = client
+        self.prefix = prefix
+
+    def _key(self, key: str) -> str:
+        return f"{self.prefix}{key}"
+
+    async def get(self, key: str) -> Optional[str]:
+        return await self.client.get(self._key(key))
+
+    async def set(self, key: str, value: str, ttl: Optional[int] = None):
+        await self.client.set(self._key(key), value, ex=ttl)
+
+    async def delete(self, key: str):
+        await self.client.delete(self._key(key))
+
+    async def hset(self, key: str, field: str, value: str):
+        await self.client.hset(self._key(key), field, value)
+
+    async def hgetall(self, key: str) -> Dict[str, str]:
+        return await self.client.hgetall(self._key(key))
+
+    async def hdel(self, key: str, field: str):
+        await self.client.hdel(self._key(key), field)
+
+    async def add_if_absent(self, key: str, value: str = '1', ttl: Optional[int] = None) -> bool:
+        return bool(await self.client.set(self._key(key), value, ex=ttl, nx=True))
+
+    async def incr(self, key: str, ttl: int) -> int:
+        # The key gets its expiry when created, so a worker dying between the
+        # two commands cannot leave a counter that never expires
+        async with self.client.pipeline(transaction=False) as pipe:
+            pipe.set(self._key(key), 0, ex=ttl, nx=True)
+            pipe.incr(self._key(key))
+            _, count = await pipe.execute()
+        return count
+
+    async def close(self):
+        await self.client.close()
+        logger.info("🔒 Shared state connection closed")
+
+def create_shared_state() -> SharedStateBackend:
+    """Create the backend selected by SHARED_STATE_URL"""
+    url = os.getenv('SHARED_STATE_URL', '')
+    if not url:
+        logger.info("🧩 Using in-memory shared state (single worker)")
+        return MemoryBackend()
+
+    try:
+        import redis.asyncio as redis
+    except ImportError:
+        raise ValueError("SHARED_STATE_URL is set but the 'redis' package is not installed")
+
+    client = redis.from_url(url, decode_responses=True)
+    logger.info("🧩 Using Redis shared state")
+    return RedisBackend(client, os.getenv('SHARED_STATE_PREFIX', 'marzban-bot:'))
@@ -0,0 +1,146 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import asyncio
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+class StateStore:
+    """Embedded SQLite (WAL) store for state that must survive restarts.
+
+    Reads are served from an in-memory mirror loaded once at startup; writes
+    update the mirror immediately and are flushed to disk in batches from a
+    worker thread so the event loop never blocks on SQLite.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.getenv('STATE_DB_PATH', '/app/data/state.db')
+        self.flush_interval = float(os.getenv('STATE_FLUSH_INTERVAL', '2'))
+        self._conn = None
+        self._data: Dict[str, Dict[str, Any]] = {}
+        # (namespace, key) -> serialized value, or None for a delete
+        self._pending: Dict[Tuple[str, str], Optional[str]] = {}
+        self._flush_lock = asyncio.Lock()
+        self._flush_task = None
+
+        logger.info(f"💾 State store initialized at {self.path}")
+
+    async def open(self):
+        """Open the database and load every namespace into memory"""
+        await asyncio.to_thread(self._open_and_load)
+        self._flush_task = asyncio.create_task(self._flush_loop())
+        total = sum(len(values) for values in self._data.values())
+        logger.info(f"✅ State store loaded {total} entries")
+
+    def _open_and_load(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS state (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (namespace, key)
+            ) WITHOUT ROWID
+            """
+        )
+        self._conn.commit()
+
+        for namespace, key, value in self._conn.execute("SELECT namespace, key, value FROM state"):
+            try:
+                self._data.setdefault(namespace, {})[key] = json.loads(value)
+            except json.JSONDecodeError:
+                logger.warning(f"⚠️ Skipping corrupt state entry {namespace}/{key}")
+
+    def get(self, namespace: str, key: str, default: Any = None) -> Any:
+        """Get a value from the in-memory mirror"""
+        return self._data.get(namespace, {}).get(key, default)
+
+    def items(self, namespace: str) -> Dict[str, Any]:
+        """Get a copy of every entry in a namespace"""
+        return dict(self._data.get(namespace, {}))
+
+    def set(self, namespace: str, key: str, value: Any):
+        """Set a value; it is persisted on the next batched flush"""
+        self._data.setdefault(namespace, {})[key] = value
+        self._pending[(namespace, key)] = json.dumps(value, ensure_ascii=False)
+
+    def delete(self, namespace: str, key: str):
+        """Delete a value; it is removed on the next batched flush"""
+        if self._data.get(namespace, {}).pop(key, None) is not None:
+            self._pending[(namespace, key)] = None
+
+    def replace_namespace(self, namespace: str, values: Dict[str, Any]):
+        """Replace a whole namespace, e.g. with a fresh cache snapshot"""
+        for key in set(self._data.get(namespace, {})) - set(values):
+            self.delete(namespace, key)
+        for key, value in values.items():
+            self.set(namespace, key, value)
+
+    async def flush(self):
+        """Write all pending changes to disk in a single transaction"""
+        async with self._flush_lock:
+            if not self._pending or not self._conn:
+                return
+            batch, self._pending = self._pending, {}
+            write = asyncio.ensure_future(asyncio.to_thread(self._write_batch, batch))
+            try:
+                # Shielded so a cancelled flush still finishes its write (the
+                # thread cannot be stopped) before the lock is released
+                await asyncio.shield(write)
+            except asyncio.CancelledError:
+                await asyncio.wait([write])
+                if not write.cancelled() and write.exception():
+                    self._requeue(batch, write.exception())
+                raise
+            except Exception as e:
+                self._requeue(batch, e)
+
+    def _requeue(self, batch: Dict[Tuple[str, str], Optional[str]], error: BaseException):
+        logger.error(f"❌ State flush failed: {error}")
+        # Keep newer writes that arrived while flushing
+        batch.update(self._pending)
+        self._pending = batch
+
+    def _write_batch(self, batch: Dict[Tuple[str, str], Optional[str]]):
+        now = time.time()
+        upserts = [(ns, key, value, now) for (ns, key), value in batch.items() if value is not None]
+        deletes = [(ns, key) for (ns, key), value in batch.items() if value is None]
+
+        with self._conn:
+            if upserts:
+                self._conn.executemany(
+                    "INSERT INTO state (namespace, key, value, updated_at) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(namespace, key) DO UPDATE SET value=excluded.value, updated_at=excluded.updated_at",
+                    upserts
+                )
+            if deletes:
+                self._conn.executemany("DELETE FROM state WHERE namespace = ? AND key = ?", deletes)
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def close(self):
+        """Flush pending writes and close the database"""
+        if self._flush_task:
+            self._flush_task.cancel()
+            # Wait for a write in progress so the final flush does not run alongside it
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+            self._flush_task = None
+        await self.flush()
+        if self._conn:
+            await asyncio.to_thread(self._conn.close)
+            self._conn = None
+            logger.info("🔒 State store closed")
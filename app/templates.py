@@ -0,0 +1,259 @@
+import re
+import textwrap
+from string import Formatter
+from typing import Any, Dict, List
+
+# Telegram rejects longer messages
+MAX_MESSAGE_LENGTH = 4096
+
+_MARKDOWN_SPECIAL = re.compile(r'([_*`\[])')
+# Everything but bold, which AI answers use for headings
+_MARKDOWN_NON_BOLD = re.compile(r'([_`\[])')
+
+def escape_markdown(text: str) -> str:
+    """Escape a value for Telegram's (legacy) Markdown outside of entities"""
+    return _MARKDOWN_SPECIAL.sub(r'\\\1', text)
+
+def escape_code(text: str) -> str:
+    """Make a value safe inside a `code` span, where escaping is not possible"""
+    return text.replace('`', "'")
+
+def is_valid_markdown(text: str) -> bool:
+    """Check locally that Telegram will accept text with parse_mode='Markdown'
+
+    Every entity must be closed. Checking before sending lets a bad message
+    go out as plain text instead of costing a rejected API call.
+    """
+    i, length = 0, len(text)
+    while i < length:
+        char = text[i]
+        if char == '\\':
+            i += 2
+            continue
+        if text.startswith('```', i):
+            end = text.find('```', i + 3)
+            if end == -1:
+                return False
+            i = end + 3
+            continue
+        if char in '*_`':
+            end = text.find(char, i + 1)
+            if end == -1:
+                return False
+            i = end + 1
+            continue
+        if char == '[':
+            end = text.find(']', i + 1)
+            if end == -1:
+                return False
+            i = end + 1
+            if text.startswith('(', i):
+                end = text.find(')', i + 1)
+                if end == -1:
+                    return False
+                i = end + 1
+            continue
+        i += 1
+    return True
+
+def safe_markdown(text: str) -> str:
+    """Make untrusted text (e.g. AI output) safe to send as Markdown
+
+    Only balanced *bold* is kept. Underscores, backticks and brackets are
+    always escaped: usernames like user_a or user_b must not turn into
+    italics even when the markers happen to balance.
+    """
+    escaped = _MARKDOWN_NON_BOLD.sub(r'\\\1', text)
+    return escaped if is_valid_markdown(escaped) else escape_markdown(text)
+
+def split_message(text: str, limit: int = MAX_MESSAGE_LENGTH) -> List[str]:
+    """Split text into chunks Telegram accepts, preferring paragraph and line breaks"""
+    chunks = []
+    while len(text) > limit:
+        cut = text.rfind('\n\n', 0, limit)
+        if cut <= 0:
+            cut = text.rfind('\n', 0, limit)
+        if cut <= 0:
+            cut = text.rfind(' ', 0, limit)
+        if cut <= 0:
+            cut = limit
+        chunks.append(text[:cut].rstrip())
+        text = text[cut:].lstrip('\n ')
+    if text:
+        chunks.append(text)
+    return chunks
+
+class Template:
+    """A reply template parsed once, rendered with escaped fields.
+
+    Uses str.format syntax. Fields are Markdown-escaped; `{name!c}` marks a
+    field placed inside a `code` span, where only backticks are replaced.
+    """
+
+    def __init__(self, source: str):
+        source = textwrap.dedent(source).strip()
+        self._parts = []
+        for literal, field, format_spec, conversion in Formatter().parse(source):
+            self._parts.append((literal, field, format_spec, conversion))
+        # Templates without fields are rendered once up front
+        self._static = source if all(field is None for _, field, _, _ in self._parts) else None
+
+    def render(self, **fields: Any) -> str:
+        if self._static is not None:
+            return self._static
+
+        output = []
+        for literal, field, format_spec, conversion in self._parts:
+            output.append(literal)
+            if field is None:
+                continue
+            value = format(fields[field], format_spec) if format_spec else str(fields[field])
+            output.append(escape_code(value) if conversion == 'c' else escape_markdown(value))
+        return ''.join(output)
+
+class TemplateRegistry:
+    """Named templates compiled once at startup"""
+
+    def __init__(self, sources: Dict[str, str]):
+        self._templates = {name: Template(source) for name, source in sources.items()}
+
+    def render(self, name: str, **fields: Any) -> str:
+        return self._templates[name].render(**fields)
+
+TEMPLATES = TemplateRegistry({
+    'welcome': """
+        🤖 **سلام! به بات پشتیبانی VPN خوش آمدید**
+
+        من می‌تونم کمکتون کنم با:
+        • درخواست اکانت جدید
+        • بررسی وضعیت اکانت
+        • تمدید اشتراک
+        • دریافت فایل کانفیگ
+        • راهنمایی نصب و استفاده
+
+        فقط کافیه سوالتون رو بپرسید! 😊
+
+        **مثال‌ها:**
+        - "اکانت جدید می‌خوام"
+        - "وضعیت اکانت user123 چطوره؟"
+        - "چطور تو گوشیم نصب کنم؟"
+    """,
+
+    'help': """
+        🆘 **راهنمای استفاده**
+
+        **دستورات موجود:**
+        • `/start` - شروع کار با بات
+        • `/help` - نمایش این راهنما
+        • `/status` - وضعیت سیستم
+
+        **خدمات:**
+        🔹 **درخواست اکانت:** "اکانت جدید می‌خوام"
+        🔹 **بررسی وضعیت:** "وضعیت اکانت [نام کاربری]"
+        🔹 **تمدید اشتراک:** "تمدید اکانت [نام کاربری]"
+        🔹 **دریافت کانفیگ:** "فایل کانفیگ [نام کاربری]"
+        🔹 **راهنمایی نصب:** "چطور نصب کنم؟"
+
+        فقط کافیه سوالتون رو به زبان ساده بپرسید! 🤖
+    """,
+
+    'status': """
+        📊 **وضعیت سیستم**
+
+        🔗 **اتصال مرزبان:** {marzban}
+        🧠 **هوش مصنوعی:** {ai}
+        🤖 **بات:** ✅ فعال
+
+        آخرین بروزرسانی: {updated_at}
+    """,
+
+    'account_request_manual': """
+        📝 **درخواست اکانت جدید ثبت شد**
+
+        درخواست شما برای ایجاد اکانت جدید ثبت شد.
+        پشتیبانی ما در اسرع وقت با شما تماس خواهد گرفت.
+
+        🕐 زمان پاسخ: معمولاً کمتر از 2 ساعت
+        📞 پشتیبانی: @support\\_username
+    """,
+
+    'provision_failed': """
+        ❌ **ساخت اکانت با خطا مواجه شد**
+
+        لطفاً کمی بعد دوباره تلاش کنید یا با پشتیبانی تماس بگیرید.
+        📞 پشتیبانی: @support\\_username
+    """,
+
+    'provision_created': """
+        ✅ **اکانت شما ساخته شد**
+
+        🏷️ **نام کاربری:** {username}
+
+        🔗 **لینک اشتراک:**
+        `{subscription_url!c}`
+
+        📋 **راهنمای نصب:**
+        1. لینک بالا را کپی کنید
+        2. در اپلیکیشن VPN خود وارد کنید
+        3. روی "اتصال" کلیک کنید
+    """,
+
+    'provision_existing': """
+        ℹ️ **شما قبلاً اکانت دارید**
+
+        🏷️ **نام کاربری:** {username}
+
+        🔗 **لینک اشتراک:**
+        `{subscription_url!c}`
+    """,
+
+    'user_not_found': "❌ کاربر '{username}' یافت نشد",
+
+    'user_info': """
+        👤 **اطلاعات اکانت**
+
+        🏷️ **نام کاربری:** {username}
+        {status_emoji} **وضعیت:** {status}
+        📊 **مصرف:** {used_gb:.2f} GB از {limit_gb} GB
+        📅 **تاریخ ایجاد:** {created_at}
+        ⏰ **انقضا:** {expire}
+
+        🔗 **لینک اشتراک:**
+        `{subscription_url!c}`
+    """,
+
+    'config_ready': """
+        📱 **فایل کانفیگ آماده است**
+
+        🔗 **لینک اشتراک:**
+        `{subscription_url!c}`
+
+        📋 **راهنمای نصب:**
+        1. لینک بالا را کپی کنید
+        2. در اپلیکیشن VPN خود وارد کنید
+        3. روی "اتصال" کلیک کنید
+
+        💡 **اپلیکیشن‌های پیشنهادی:**
+        • اندروید: V2rayNG
+        • iOS: FairVPN
+        • ویندوز: V2rayN
+    """,
+
+    'config_not_found': "❌ اطلاعات کانفیگ برای '{username}' یافت نشد",
+
+    'renew': """
+        💳 **درخواست تمدید اکانت** '{username}'
+
+        برای تمدید اکانت خود، لطفاً:
+        1. مبلغ مورد نظر را واریز کنید
+        2. فیش واریزی را ارسال کنید
+        3. منتظر تأیید پشتیبانی باشید
+
+        💰 **تعرفه‌ها:**
+        • یک ماهه: 50,000 تومان
+        • سه ماهه: 140,000 تومان
+        • شش ماهه: 270,000 تومان
+
+        📞 **پشتیبانی:** @support\\_username
+    """,
+})
@@ -3,18 +3,35 @@ import hmac
 import hashlib
 import json
 import logging
+import math
+import time
 import asyncio
 from aiohttp import web, ClientSession
-from typing import Dict, Any
+from typing import Dict, Any, Optional
+
+from cache import SeenEventIndex
 
 logger = logging.getLogger(__name__)
 
+# Marzban bumps these on every retry of the same notification
+RETRY_FIELDS = ('send_at', 'tries')
+
 class WebhookServer:
     def __init__(self, bot_handler):
         self.bot = bot_handler
         self.secret = os.getenv('WEBHOOK_SECRET', 'default-secret')
         self.port = int(os.getenv('WEBHOOK_PORT', '8080'))
+        self.replay_window = float(os.getenv('WEBHOOK_REPLAY_WINDOW', '3600'))
+        self.max_clock_skew = float(os.getenv('WEBHOOK_MAX_CLOCK_SKEW', '300'))
+        # A future-dated event is still accepted replay_window + max_clock_skew
+        # after it first arrives, so IDs must be remembered at least that long
+        self.seen_retention = self.replay_window + self.max_clock_skew
+        self.seen_events = SeenEventIndex(
+            self.seen_retention,
+            max_size=int(os.getenv('WEBHOOK_SEEN_MAX', '100000'))
+        )
         self.app = web.Application()
+        self.runner = None
         self._setup_routes()
         
         logger.info(f"🔗 Webhook server initialized on port {self.port}")
@@ -23,6 +40,7 @@ class WebhookServer:
         """Setup webhook routes"""
         self.app.router.add_post('/webhook/marzban', self.handle_marzban_webhook)
         self.app.router.add_get('/health', self.health_check)
+        self.app.router.add_get('/ready', self.readiness_check)
     
     def _verify_signature(self, data: bytes, signature: str) -> bool:
         """Verify webhook signature"""
@@ -58,8 +76,15 @@ class WebhookServer:
                 logger.error("❌ Invalid JSON in webhook payload")
                 return web.Response(status=400, text="Invalid JSON")
             
-            # Process the webhook event
-            await self._process_webhook_event(payload)
+            # Marzban delivers notifications in batches
+            events = payload if isinstance(payload, list) else [payload]
+            fresh = [event for event in events if isinstance(event, dict) and await self._accept_event(event)]
+            if not fresh:
+                return web.Response(status=200, text="Ignored")
+            
+            # Process the webhook events
+            for event in fresh:
+                await self._process_webhook_event(event)
             
             return web.Response(status=200, text="OK")
             
@@ -67,6 +92,51 @@ class WebhookServer:
             logger.error(f"❌ Webhook handling error: {e}")
             return web.Response(status=500, text="Internal server error")
     
+    def _event_id(self, event: Dict[str, Any]) -> str:
+        """Sender-assigned ID, or a hash of the event without its retry counters"""
+        event_id = event.get('id') or event.get('event_id')
+        if event_id:
+            return str(event_id)
+        canonical = json.dumps(
+            {key: value for key, value in event.items() if key not in RETRY_FIELDS},
+            sort_keys=True, separators=(',', ':'), default=str
+        )
+        return hashlib.sha256(canonical.encode()).hexdigest()[:32]
+    
+    def _event_timestamp(self, event: Dict[str, Any]) -> Optional[float]:
+        """When the event was raised (covered by the signature, unlike headers)"""
+        try:
+            timestamp = event.get('enqueued_at', event.get('timestamp'))
+            return float(timestamp) if timestamp is not None else None
+        except (TypeError, ValueError):
+            return None
+    
+    async def _accept_event(self, event: Dict[str, Any]) -> bool:
+        """Reject stale and already seen events before any handler work"""
+        now = time.time()
+        timestamp = self._event_timestamp(event)
+        if timestamp is None:
+            # Without a signed timestamp a captured body could be replayed once
+            # its ID has left the seen-event index
+            logger.warning(f"⚠️ Webhook event without timestamp ignored: {event.get('action')}")
+            return False
+        if not now - self.replay_window <= timestamp <= now + self.max_clock_skew:
+            logger.warning(f"⚠️ Webhook event outside replay window ignored: {event.get('action')}")
+            return False
+        
+        event_id = self._event_id(event)
+        if not self.seen_events.add(event_id, now):
+            logger.info(f"♻️ Duplicate webhook event ignored: {event_id}")
+            return False
+        
+        # Other workers may have received the same delivery
+        if self.bot.shared_state.is_shared and not await self.bot.shared_state.add_if_absent(
+            f"webhook:{event_id}", ttl=math.ceil(self.seen_retention) + 1
+        ):
+            logger.info(f"♻️ Duplicate webhook event ignored: {event_id}")
+            return False
+        return True
+    
     async def _process_webhook_event(self, payload: Dict[str, Any]):
         """Process webhook event from Marzban"""
         try:
@@ -74,6 +144,7 @@ class WebhookServer:
             username = payload.get('username')
             
             logger.info(f"📨 Webhook event: {action} for user: {username}")
+            self.bot.analytics.record_event(action, username)
             
             # Handle different event types
             if action == 'user_created':
@@ -136,7 +207,20 @@ class WebhookServer:
             status=200, 
             text=json.dumps({
                 "status": "healthy",
-                "service": "marzban-ai-bot-webhook"
+                "service": "marzban-ai-bot-webhook",
+                "ready": self.bot.is_ready,
+                "components": self.bot.readiness
+            }),
+            content_type='application/json'
+        )
+    
+    async def readiness_check(self, request):
+        """Readiness endpoint: 200 once every backend is warmed up, 503 before"""
+        return web.Response(
+            status=200 if self.bot.is_ready else 503,
+            text=json.dumps({
+                "ready": self.bot.is_ready,
+                "components": self.bot.readiness
             }),
             content_type='application/json'
         )
@@ -146,18 +230,27 @@ class WebhookServer:
         try:
             logger.info(f"🚀 Starting webhook server on port {self.port}")
             
-            runner = web.AppRunner(self.app)
-            await runner.setup()
+            self.runner = web.AppRunner(self.app)
+            await self.runner.setup()
             
-            site = web.TCPSite(runner, '0.0.0.0', self.port)
+            site = web.TCPSite(self.runner, '0.0.0.0', self.port)
             await site.start()
             
             logger.info(f"✅ Webhook server started successfully")
-            
-            # Keep the server running
-            while True:
-                await asyncio.sleep(3600)  # Sleep for 1 hour
                 
         except Exception as e:
             logger.error(f"❌ Failed to start webhook server: {e}")
-            raise
\ No newline at end of file
+            raise
+    
+    async def stop(self, timeout: float = 20):
+        """Stop accepting requests and wait for in-flight webhooks to finish"""
+        if not self.runner:
+            return
+        logger.info("🛑 Stopping webhook server...")
+        try:
+            # cleanup() closes the listener first, then waits for running handlers
+            await asyncio.wait_for(self.runner.cleanup(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"⚠️ In-flight webhooks not finished within {timeout}s")
+        self.runner = None
+        logger.info("✅ Webhook server stopped")
\ No newline at end of file
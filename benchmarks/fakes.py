@@ -0,0 +1,347 @@
+"""
+Local stand-ins for Marzban, Redis, Gemini and Telegram used by the benchmarks
+"""
+
+import json
+import time
+import random
+import asyncio
+import itertools
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+from aiohttp import web
+
+from llm_backends import LLMBackend
+
+class FakeMarzbanServer:
+    """Minimal Marzban panel API with configurable latency and token expiry"""
+
+    def __init__(self, latency: float = 0.02, token_ttl: float = 300, users: int = 1000, seed: int = 1):
+        self.latency = latency
+        self.token_ttl = token_ttl
+        self.rng = random.Random(seed)
+        self.tokens: Dict[str, float] = {}
+        self.token_counter = itertools.count(1)
+        self.requests = 0
+        self.logins = 0
+        self.users = {f"user{i}": self._make_user(f"user{i}") for i in range(users)}
+
+        self.app = web.Application()
+        self.app.router.add_post('/api/admin/token', self.login)
+        self.app.router.add_get('/api/system', self.system)
+        self.app.router.add_get('/api/users', self.list_users)
+        self.app.router.add_post('/api/user', self.create_user)
+        self.app.router.add_get('/api/user/{username}', self.get_user)
+        self.app.router.add_put('/api/user/{username}', self.modify_user)
+        self.app.router.add_post('/api/user/{username}/reset', self.reset_user)
+        self.runner = None
+        self.url = None
+
+    def _make_user(self, username: str) -> Dict[str, Any]:
+        return {
+            'username': username,
+            'status': 'active',
+            'used_traffic': self.rng.randint(0, 20 * 1024**3),
+            'data_limit': 20 * 1024**3,
+            'expire': int(time.time()) + self.rng.randint(1, 60) * 86400,
+            'created_at': '2024-01-01T00:00:00',
+            'subscription_url': f"https://panel.example/sub/{username}",
+            'links': [f"vless://{username}@panel.example:443", f"vmess://{username}@panel.example:443"]
+        }
+
+    async def start(self) -> str:
+        self.runner = web.AppRunner(self.app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}"
+        return self.url
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+
+    async def _delay(self):
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    def _authorized(self, request) -> bool:
+        token = request.headers.get('Authorization', '').removeprefix('Bearer ')
+        issued = self.tokens.get(token)
+        return issued is not None and time.monotonic() - issued < self.token_ttl
+
+    async def login(self, request):
+        await self._delay()
+        self.logins += 1
+        token = f"token-{next(self.token_counter)}"
+        self.tokens[token] = time.monotonic()
+        return web.json_response({'access_token': token, 'token_type': 'bearer'})
+
+    async def system(self, request):
+        await self._delay()
+        if not self._authorized(request):
+            return web.json_response({'detail': 'expired'}, status=401)
+        active = sum(1 for user in self.users.values() if user['status'] == 'active')
+        return web.json_response({
+            'total_user': len(self.users),
+            'users_active': active,
+            'incoming_bandwidth': sum(user['used_traffic'] for user in self.users.values()) // 2,
+            'outgoing_bandwidth': sum(user['used_traffic'] for user in self.users.values()) // 2
+        })
+
+    async def list_users(self, request):
+        await self._delay()
+        if not self._authorized(request):
+            return web.json_response({'detail': 'expired'}, status=401)
+        status = request.query.get('status')
+        offset = int(request.query.get('offset', 0))
+        limit = int(request.query.get('limit', 100))
+        users = [user for user in self.users.values() if not status or user['status'] == status]
+        return web.json_response({'users': users[offset:offset + limit], 'total': len(users)})
+
+    async def create_user(self, request):
+        await self._delay()
+        if not self._authorized(request):
+            return web.json_response({'detail': 'expired'}, status=401)
+        data = await request.json()
+        if data['username'] in self.users:
+            return web.json_response({'detail': 'User already exists'}, status=409)
+        user = self._make_user(data['username'])
+        user.update(used_traffic=0, data_limit=data.get('data_limit'), expire=data.get('expire'))
+        self.users[user['username']] = user
+        return web.json_response(user)
+
+    async def get_user(self, request):
+        await self._delay()
+        if not self._authorized(request):
+            return web.json_response({'detail': 'expired'}, status=401)
+        user = self.users.get(request.match_info['username'])
+        if not user:
+            return web.json_response({'detail': 'User not found'}, status=404)
+        return web.json_response(user)
+
+    async def modify_user(self, request):
+        await self._delay()
+        if not self._authorized(request):
+            return web.json_response({'detail': 'expired'}, status=401)
+        user = self.users.get(request.match_info['username'])
+        if not user:
+            return web.json_response({'detail': 'User not found'}, status=404)
+        user.update(await request.json())
+        # Like Marzban, moving the expiry into the future reactivates the user
+        if user['status'] == 'expired' and user.get('expire') and user['expire'] > time.time():
+            user['status'] = 'active'
+        return web.json_response(user)
+
+    async def reset_user(self, request):
+        await self._delay()
+        if not self._authorized(request):
+            return web.json_response({'detail': 'expired'}, status=401)
+        user = self.users.get(request.match_info['username'])
+        if not user:
+            return web.json_response({'detail': 'User not found'}, status=404)
+        user['used_traffic'] = 0
+        return web.json_response(user)
+
+class FakeRedisServer:
+    """Minimal Redis (RESP2) server with the commands RedisBackend uses"""
+
+    def __init__(self):
+        # key -> (value or hash dict, expires_at or None)
+        self.data: Dict[str, tuple] = {}
+        self.commands = 0
+        self.server = None
+        self.url = None
+
+    async def start(self) -> str:
+        self.server = await asyncio.start_server(self._serve, '127.0.0.1', 0)
+        port = self.server.sockets[0].getsockname()[1]
+        self.url = f"redis://127.0.0.1:{port}/0"
+        return self.url
+
+    async def stop(self):
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+
+    def _live(self, key: str) -> Optional[str]:
+        entry = self.data.get(key)
+        if entry and entry[1] is not None and entry[1] <= time.monotonic():
+            del self.data[key]
+            return None
+        return entry[0] if entry else None
+
+    async def _read_command(self, reader) -> Optional[List[str]]:
+        header = await reader.readline()
+        if not header:
+            return None
+        parts = []
+        for _ in range(int(header[1:])):
+            length = int((await reader.readline())[1:])
+            parts.append((await reader.readexactly(length + 2))[:-2].decode())
+        return parts
+
+    async def _serve(self, reader, writer):
+        try:
+            while True:
+                command = await self._read_command(reader)
+                if command is None:
+                    break
+                self.commands += 1
+                writer.write(self._execute(command[0].upper(), command[1:]))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def _execute(self, name: str, args: List[str]) -> bytes:
+        def bulk(value):
+            if value is None:
+                return b'$-1\r\n'
+            value = value.encode()
+            return b'$%d\r\n%s\r\n' % (len(value), value)
+
+        if name == 'PING':
+            return b'+PONG\r\n'
+        if name in ('CLIENT', 'SELECT'):
+            return b'+OK\r\n'
+        if name == 'GET':
+            return bulk(self._live(args[0]))
+        if name == 'SET':
+            key, value, options = args[0], args[1], [arg.upper() for arg in args[2:]]
+            if 'NX' in options and self._live(key) is not None:
+                return b'$-1\r\n'
+            ttl = int(args[2 + options.index('EX') + 1]) if 'EX' in options else None
+            self.data[key] = (value, time.monotonic() + ttl if ttl else None)
+            return b'+OK\r\n'
+        if name == 'DEL':
+            removed = sum(1 for key in args if self._live(key) is not None and self.data.pop(key))
+            return b':%d\r\n' % removed
+        if name in ('INCR', 'INCRBY'):
+            current = self._live(args[0])
+            count = int(current or 0) + (int(args[1]) if name == 'INCRBY' else 1)
+            expires_at = self.data[args[0]][1] if current is not None else None
+            self.data[args[0]] = (str(count), expires_at)
+            return b':%d\r\n' % count
+        if name == 'HSET':
+            fields = self._live(args[0]) or {}
+            added = sum(1 for field in args[1::2] if field not in fields)
+            fields.update(zip(args[1::2], args[2::2]))
+            self.data[args[0]] = (fields, None)
+            return b':%d\r\n' % added
+        if name == 'HGETALL':
+            flat = [item for pair in (self._live(args[0]) or {}).items() for item in pair]
+            return b'*%d\r\n' % len(flat) + b''.join(bulk(item) for item in flat)
+        if name == 'HDEL':
+            fields = self._live(args[0]) or {}
+            return b':%d\r\n' % sum(1 for field in args[1:] if fields.pop(field, None) is not None)
+        if name == 'EXPIRE':
+            if self._live(args[0]) is None:
+                return b':0\r\n'
+            self.data[args[0]] = (self.data[args[0]][0], time.monotonic() + int(args[1]))
+            return b':1\r\n'
+        return f"-ERR unknown command '{name}'\r\n".encode()
+
+class ScriptedLLMBackend(LLMBackend):
+    """Stand-in for the Gemini provider inside GeminiHandler, returning scripted JSON.
+
+    A fraction of answers (slow_rate) takes slow_factor times longer, so the
+    handler's hedging to the next provider is exercised.
+    """
+
+    name = 'scripted'
+
+    def __init__(self, latency: float = 0.3, jitter: float = 0.1, slow_rate: float = 0.0,
+                 slow_factor: float = 10, seed: int = 1):
+        super().__init__()
+        self.latency = latency
+        self.jitter = jitter
+        self.slow_rate = slow_rate
+        self.slow_factor = slow_factor
+        self.rng = random.Random(seed)
+        self.calls = 0
+
+    def _script(self, message: str) -> Dict[str, Any]:
+        username = next((word for word in message.split() if word.startswith('user')), None)
+        if 'کانفیگ' in message:
+            action = 'GET_CONFIG'
+        elif 'وضعیت' in message:
+            action = 'CHECK_ACCOUNT'
+        elif 'اکانت جدید' in message:
+            action = 'REQUEST_ACCOUNT'
+        else:
+            action = 'NONE'
+        return {
+            'response': 'پاسخ آزمایشی',
+            'action': action,
+            'parameters': {'username': username} if username else {},
+            'confidence': 0.9
+        }
+
+    async def generate(self, prompt: str, message: str) -> str:
+        self.calls += 1
+        delay = max(0.0, self.rng.gauss(self.latency, self.jitter))
+        if self.rng.random() < self.slow_rate:
+            delay *= self.slow_factor
+        await asyncio.sleep(delay)
+        return json.dumps(self._script(message), ensure_ascii=False)
+
+class FakeTelegramBot:
+    """Records what the bot would have sent to Telegram"""
+
+    def __init__(self):
+        self.sent: List[Any] = []
+        self.file_ids = itertools.count(1)
+
+    def _photo_message(self):
+        return SimpleNamespace(photo=[SimpleNamespace(file_id=f"file-{next(self.file_ids)}")])
+
+    async def send_chat_action(self, chat_id, action):
+        pass
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent.append(text)
+        return SimpleNamespace(message_id=len(self.sent))
+
+    async def edit_message_text(self, text, chat_id=None, message_id=None, **kwargs):
+        self.sent.append(text)
+
+    async def send_photo(self, chat_id, photo, **kwargs):
+        self.sent.append(photo)
+        return self._photo_message()
+
+    async def send_media_group(self, chat_id, media, **kwargs):
+        self.sent.extend(media)
+        return [self._photo_message() for _ in media]
+
+class FakeMessage:
+    def __init__(self, bot: FakeTelegramBot, chat_id: int, text: str):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.text = text
+
+    async def reply_text(self, text, **kwargs):
+        return await self.bot.send_message(self.chat_id, text, **kwargs)
+
+class TelegramUpdateInjector:
+    """Builds Update/Context look-alikes that handlers accept"""
+
+    def __init__(self, bot: FakeTelegramBot):
+        self.bot = bot
+        self.update_ids = itertools.count(1)
+
+    def message(self, user_id: int, text: str, args: Optional[List[str]] = None):
+        user = SimpleNamespace(id=user_id)
+        chat = SimpleNamespace(id=user_id)
+        update = SimpleNamespace(
+            update_id=next(self.update_ids),
+            effective_user=user,
+            effective_chat=chat,
+            message=FakeMessage(self.bot, user_id, text)
+        )
+        context = SimpleNamespace(bot=self.bot, args=args or [])
+        return update, context
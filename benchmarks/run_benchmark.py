@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+Offline end-to-end benchmark for the bot
+
+Runs MarzbanAIBot.handle_message and the Marzban webhook endpoint against
+local stand-ins (see fakes.py) at a fixed arrival rate and reports
+throughput, latency percentiles and memory. With the same arguments and
+seed the workload is identical between runs, so results can be compared
+before and after a change.
+
+    python benchmarks/run_benchmark.py --rate 50 --duration 20
+    python benchmarks/run_benchmark.py --scenario webhooks --json results.json
+"""
+
+import os
+import sys
+import json
+import time
+import hmac
+import random
+import asyncio
+import hashlib
+import logging
+import argparse
+import resource
+import tempfile
+import tracemalloc
+
+import aiohttp
+from aiohttp import web
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.join(os.path.dirname(BENCH_DIR), 'app'))
+
+from fakes import FakeMarzbanServer, ScriptedLLMBackend, FakeTelegramBot, TelegramUpdateInjector
+
+MESSAGE_TEMPLATES = [
+    "وضعیت اکانت {username} چطوره؟",
+    "فایل کانفیگ {username} رو می‌خوام",
+    "چطور تو گوشیم نصب کنم؟",
+    "سلام",
+]
+
+WEBHOOK_ACTIONS = ['user_created', 'user_updated', 'user_limited', 'user_expired', 'user_deleted']
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def summarize(name, latencies, errors, elapsed):
+    latencies = sorted(latencies)
+    return {
+        'scenario': name,
+        'requests': len(latencies) + errors,
+        'errors': errors,
+        'throughput_rps': round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        'max_ms': round(latencies[-1] * 1000, 2) if latencies else 0.0,
+    }
+
+async def run_open_loop(rate, count, make_call):
+    """Start one call every 1/rate seconds regardless of completions and time each one"""
+    latencies = []
+    errors = 0
+
+    async def timed(call):
+        nonlocal errors
+        started = time.perf_counter()
+        try:
+            await call
+            latencies.append(time.perf_counter() - started)
+        except Exception:
+            errors += 1
+
+    started = time.perf_counter()
+    tasks = []
+    for i in range(count):
+        delay = started + i / rate - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(timed(make_call(i))))
+    await asyncio.gather(*tasks)
+    return latencies, errors, time.perf_counter() - started
+
+async def bench_messages(bot, args):
+    rng = random.Random(args.seed)
+    telegram = FakeTelegramBot()
+    injector = TelegramUpdateInjector(telegram)
+
+    def make_call(i):
+        text = rng.choice(MESSAGE_TEMPLATES).format(username=f"user{rng.randrange(args.users)}")
+        update, context = injector.message(100000 + rng.randrange(args.telegram_users), text)
+        return bot.handle_message(update, context)
+
+    latencies, errors, elapsed = await run_open_loop(args.rate, int(args.rate * args.duration), make_call)
+    return summarize('messages', latencies, errors, elapsed)
+
+async def bench_webhooks(bot, args):
+    from webhook_server import WebhookServer
+
+    rng = random.Random(args.seed)
+    server = WebhookServer(bot)
+    runner = web.AppRunner(server.app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    url = f"http://127.0.0.1:{port}/webhook/marzban"
+
+    async with aiohttp.ClientSession() as session:
+        async def post(i):
+            body = json.dumps({
+                'action': rng.choice(WEBHOOK_ACTIONS),
+                'username': f"user{rng.randrange(args.users)}",
+                'enqueued_at': time.time(),
+                'event_id': f"bench-{args.seed}-{i}"
+            }).encode()
+            signature = hmac.new(server.secret.encode(), body, hashlib.sha256).hexdigest()
+            async with session.post(url, data=body, headers={'x-webhook-secret': signature}) as response:
+                await response.read()
+                if response.status != 200:
+                    raise RuntimeError(f"HTTP {response.status}")
+
+        latencies, errors, elapsed = await run_open_loop(args.rate, int(args.rate * args.duration), post)
+
+    await runner.cleanup()
+    return summarize('webhooks', latencies, errors, elapsed)
+
+async def main(args):
+    marzban = FakeMarzbanServer(
+        latency=args.marzban_latency, token_ttl=args.token_ttl, users=args.users, seed=args.seed
+    )
+    state_dir = tempfile.mkdtemp(prefix='marzban-bot-bench-')
+    os.environ.update({
+        'TELEGRAM_BOT_TOKEN': '123456:benchmark',
+        'GEMINI_API_KEY': 'benchmark',
+        'MARZBAN_URL': await marzban.start(),
+        'MARZBAN_USERNAME': 'admin',
+        'MARZBAN_PASSWORD': 'admin',
+        'WEBHOOK_SECRET': 'benchmark-secret',
+        'STATE_DB_PATH': os.path.join(state_dir, 'state.db'),
+        'RATE_LIMIT_MESSAGES': '0',
+        'SHARED_STATE_URL': '',
+        'LLM_PROVIDERS': 'gemini,rules',
+    })
+    if args.no_cache:
+        os.environ.update({'USER_CACHE_TTL': '0', 'AI_CACHE_TTL': '0'})
+
+    from bot_handler import MarzbanAIBot
+
+    tracemalloc.start()
+    bot = MarzbanAIBot()
+    # The real GeminiHandler with its primary provider scripted, so hedging to
+    # the rule-based provider is part of what is measured
+    scripted = ScriptedLLMBackend(
+        latency=args.gemini_latency, jitter=args.gemini_latency / 3, slow_rate=args.gemini_slow_rate, seed=args.seed
+    )
+    bot.gemini.providers[0] = scripted
+    await bot.store.open()
+
+    results = []
+    if args.scenario in ('messages', 'all'):
+        results.append(await bench_messages(bot, args))
+    if args.scenario in ('webhooks', 'all'):
+        results.append(await bench_webhooks(bot, args))
+
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    await bot.store.close()
+    await bot.marzban.close()
+    bot.qr_codes.close()
+    await marzban.stop()
+
+    report = {
+        'config': vars(args),
+        'results': results,
+        'gemini_calls': scripted.calls,
+        'hedges': bot.gemini.hedges,
+        'marzban_requests': marzban.requests,
+        'marzban_logins': marzban.logins,
+        'peak_traced_mb': round(peak / 1024**2, 2),
+        'max_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 2),
+    }
+    return report
+
+def print_report(report):
+    print(f"{'scenario':<10} {'reqs':>6} {'err':>4} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for r in report['results']:
+        print(
+            f"{r['scenario']:<10} {r['requests']:>6} {r['errors']:>4} {r['throughput_rps']:>8} "
+            f"{r['p50_ms']:>9} {r['p95_ms']:>9} {r['p99_ms']:>9} {r['max_ms']:>9}"
+        )
+    print(
+        f"\nGemini calls: {report['gemini_calls']} (hedged: {report['hedges']})  Marzban requests: {report['marzban_requests']} "
+        f"(logins: {report['marzban_logins']})"
+    )
+    print(f"Peak traced memory: {report['peak_traced_mb']} MB  Max RSS: {report['max_rss_mb']} MB")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenario', choices=['messages', 'webhooks', 'all'], default='all')
+    parser.add_argument('--rate', type=float, default=20, help='requests started per second')
+    parser.add_argument('--duration', type=float, default=10, help='seconds of load per scenario')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--users', type=int, default=1000, help='panel users in the fake Marzban')
+    parser.add_argument('--telegram-users', type=int, default=200, help='distinct Telegram senders')
+    parser.add_argument('--marzban-latency', type=float, default=0.02, help='seconds per panel request')
+    parser.add_argument('--gemini-latency', type=float, default=0.3, help='mean seconds per AI answer')
+    parser.add_argument('--gemini-slow-rate', type=float, default=0.05, help='fraction of AI answers 10x slower')
+    parser.add_argument('--token-ttl', type=float, default=5, help='seconds before panel tokens return 401')
+    parser.add_argument('--no-cache', action='store_true', help='disable the user and AI caches')
+    parser.add_argument('--json', help='also write the report to this file')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    report = asyncio.run(main(args))
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Shared state check against a local Redis stand-in
+
+Runs two RedisBackend clients, standing in for two bot workers, against
+FakeRedisServer and checks that claims, counters, values and the rate
+limiter are shared between them. Point SHARED_STATE_URL at a real Redis
+to run the same checks there.
+
+    python benchmarks/shared_state_check.py
+    SHARED_STATE_URL=redis://localhost:6379/15 python benchmarks/shared_state_check.py
+"""
+
+import os
+import sys
+import uuid
+import asyncio
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.join(os.path.dirname(BENCH_DIR), 'app'))
+
+from fakes import FakeRedisServer
+from shared_state import RedisBackend, create_shared_state
+from rate_limiter import RateLimiter
+
+async def check(first, second):
+    # Keys are unique per run so a real Redis can be reused
+    run = uuid.uuid4().hex[:8]
+    checks = []
+
+    def expect(name, condition):
+        checks.append((name, bool(condition)))
+
+    expect("add_if_absent claims once across workers", (
+        await first.add_if_absent(f"{run}:claim", ttl=60),
+        await second.add_if_absent(f"{run}:claim", ttl=60)
+    ) == (True, False))
+
+    await first.set(f"{run}:value", 'hello', ttl=60)
+    expect("set/get is visible to the other worker", await second.get(f"{run}:value") == 'hello')
+
+    await second.delete(f"{run}:value")
+    expect("delete is visible to the other worker", await first.get(f"{run}:value") is None)
+
+    counts = [await backend.incr(f"{run}:counter", 60) for backend in (first, second, first)]
+    expect("incr counts across workers", counts == [1, 2, 3])
+
+    await first.set_json(f"{run}:json", {'users': ['user1']}, ttl=60)
+    expect("JSON values round-trip", await second.get_json(f"{run}:json") == {'users': ['user1']})
+
+    await first.hset(f"{run}:hash", 'job1', 'running')
+    await second.hset(f"{run}:hash", 'job2', 'running')
+    await first.hdel(f"{run}:hash", 'job1')
+    expect("hash fields are shared", await second.hgetall(f"{run}:hash") == {'job2': 'running'})
+    await second.delete(f"{run}:hash")
+    expect("deleting a hash removes its fields", await first.hgetall(f"{run}:hash") == {})
+
+    await first.set(f"{run}:short", '1', ttl=1)
+    await first.incr(f"{run}:short-counter", 1)
+    await asyncio.sleep(1.2)
+    expect("values expire after their ttl", await second.get(f"{run}:short") is None)
+    expect("counters expire after their ttl", await second.incr(f"{run}:short-counter", 1) == 1)
+
+    os.environ.update({'RATE_LIMIT_MESSAGES': '3', 'RATE_LIMIT_WINDOW': '60'})
+    limiters = [RateLimiter(first), RateLimiter(second)]
+    user_id = int(uuid.uuid4().int % 10**9)
+    allowed = [await limiters[i % 2].allow(user_id) for i in range(4)]
+    expect("rate limit is enforced across workers", allowed == [True, True, True, False])
+
+    return checks
+
+async def main():
+    server = None
+    url = os.getenv('SHARED_STATE_URL')
+    if not url:
+        server = FakeRedisServer()
+        url = await server.start()
+    os.environ['SHARED_STATE_URL'] = url
+
+    first, second = create_shared_state(), create_shared_state()
+    try:
+        assert isinstance(first, RedisBackend) and first.is_shared
+        checks = await check(first, second)
+    finally:
+        await first.close()
+        await second.close()
+        if server:
+            await server.stop()
+
+    for name, passed in checks:
+        print(f"{'✅' if passed else '❌'} {name}")
+    if server:
+        print(f"{server.commands} commands served by the stand-in")
+    return all(passed for _, passed in checks)
+
+if __name__ == "__main__":
+    sys.exit(0 if asyncio.run(main()) else 1)
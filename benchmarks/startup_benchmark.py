@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Cold start benchmark
+
+Starts the bot in fresh interpreter processes against the local Marzban
+stand-in and measures each startup phase: module imports, construction,
+state store load, backend warm-up, and the latency of the first user
+request. Reports the median of several runs.
+
+    python benchmarks/startup_benchmark.py --runs 5
+    python benchmarks/startup_benchmark.py --no-warm-up   # first request pays for login
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import statistics
+import subprocess
+import tempfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(os.path.dirname(BENCH_DIR), 'app')
+
+PHASES = ['imports', 'construct', 'state', 'warm_up', 'first_request', 'total']
+
+async def child(args):
+    """Run one cold start and print the phase timings as JSON"""
+    sys.path.insert(0, BENCH_DIR)
+    sys.path.insert(0, APP_DIR)
+    from fakes import FakeMarzbanServer
+
+    marzban = FakeMarzbanServer(latency=args.marzban_latency, users=10)
+    os.environ.update({
+        'TELEGRAM_BOT_TOKEN': '123456:benchmark',
+        'GEMINI_API_KEY': 'benchmark',
+        'MARZBAN_URL': await marzban.start(),
+        'MARZBAN_USERNAME': 'admin',
+        'MARZBAN_PASSWORD': 'admin',
+        'STATE_DB_PATH': os.path.join(tempfile.mkdtemp(prefix='marzban-bot-startup-'), 'state.db'),
+        'SHARED_STATE_URL': '',
+    })
+    timings = {}
+
+    started = time.perf_counter()
+    from bot_handler import MarzbanAIBot
+    timings['imports'] = time.perf_counter() - started
+
+    step = time.perf_counter()
+    bot = MarzbanAIBot()
+    timings['construct'] = time.perf_counter() - step
+
+    step = time.perf_counter()
+    await bot.store.open()
+    timings['state'] = time.perf_counter() - step
+
+    step = time.perf_counter()
+    if not args.no_warm_up:
+        await bot.warm_up()
+    timings['warm_up'] = time.perf_counter() - step
+
+    # A button press: one panel round-trip, no AI call
+    step = time.perf_counter()
+    await bot._execute_action({'action': 'CHECK_ACCOUNT', 'parameters': {'username': 'user1'}}, 1)
+    timings['first_request'] = time.perf_counter() - step
+    timings['total'] = time.perf_counter() - started
+
+    await bot.store.close()
+    await bot.marzban.close()
+    await marzban.stop()
+    print(json.dumps(timings))
+
+def parent(args):
+    command = [sys.executable, os.path.abspath(__file__), '--child', '--marzban-latency', str(args.marzban_latency)]
+    if args.no_warm_up:
+        command.append('--no-warm-up')
+
+    runs = []
+    for _ in range(args.runs):
+        spawned = time.perf_counter()
+        output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+        timings = json.loads(output.strip().splitlines()[-1])
+        timings['process'] = time.perf_counter() - spawned
+        runs.append(timings)
+
+    print(f"{'phase':<14} {'median ms':>10} {'min ms':>10} {'max ms':>10}")
+    report = {}
+    for phase in PHASES + ['process']:
+        values = [run[phase] * 1000 for run in runs]
+        report[phase] = round(statistics.median(values), 1)
+        print(f"{phase:<14} {statistics.median(values):>10.1f} {min(values):>10.1f} {max(values):>10.1f}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'config': vars(args), 'median_ms': report, 'runs': runs}, f, indent=2)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--marzban-latency', type=float, default=0.05, help='seconds per panel request')
+    parser.add_argument('--no-warm-up', action='store_true', help='skip the background warm-up phase')
+    parser.add_argument('--json', help='also write the report to this file')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        import logging
+        logging.basicConfig(level=logging.WARNING)
+        asyncio.run(child(args))
+    else:
+        parent(args)
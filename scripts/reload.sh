@@ -0,0 +1,12 @@
+#!/bin/bash
+
+# Marzban AI Bot Reload Script
+
+set -e
+
+echo "🔄 Reloading Marzban AI Bot configuration..."
+
+# main.py re-reads .env on SIGHUP without dropping connections or caches
+docker-compose kill -s SIGHUP marzban-ai-bot
+
+echo "✅ Reload signal sent, check logs: docker-compose logs -f"
@@ -19,6 +19,14 @@ if ! command -v docker-compose &> /dev/null; then
     exit 1
 fi
 
+# Older compose files bind-mounted .env itself; if it was missing on "up",
+# Docker created a directory in its place
+if [ -d .env ]; then
+    echo "❌ .env is a directory (created by Docker because the file was missing)."
+    echo "   Remove it with 'rm -r .env' and run this script again."
+    exit 1
+fi
+
 # Check if .env file exists
 if [ ! -f .env ]; then
     echo "⚠️  .env file not found. Creating from template..."
@@ -28,7 +36,7 @@ if [ ! -f .env ]; then
 fi
 
 # Create logs directory if it doesn't exist
-mkdir -p logs
+mkdir -p logs data
 
 # Pull latest images and start services
 echo "📦 Pulling latest images..."
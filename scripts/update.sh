@@ -6,6 +6,14 @@ set -e
 
 echo "🔄 Updating Marzban AI Bot..."
 
+# Older compose files bind-mounted .env itself; if it was missing on "up",
+# Docker created a directory in its place
+if [ -d .env ]; then
+    echo "❌ .env is a directory (created by Docker because the file was missing)."
+    echo "   Remove it with 'rm -r .env' and run this script again."
+    exit 1
+fi
+
 # Backup current .env file
 if [ -f .env ]; then
     cp .env .env.backup.$(date +%Y%m%d_%H%M%S)